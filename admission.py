@@ -0,0 +1,69 @@
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+import config
+
+
+MAX_JOBS_PER_USER = getattr(config, 'bot_max_jobs_per_user', 1)
+MAX_RUNNING_JOBS = getattr(config, 'bot_max_running_jobs', 4)
+MAX_QUEUED_JOBS = getattr(config, 'bot_max_queued_jobs', 16)
+
+
+class JobQueue:
+    # Control de admisión de los trabajos del bot: pocos trabajos en curso por usuario y una cola
+    # global acotada. Lo que no entra se rechaza al momento en vez de quedar esperando.
+
+    def __init__(self, per_user=MAX_JOBS_PER_USER, max_running=MAX_RUNNING_JOBS, max_queued=MAX_QUEUED_JOBS):
+        self.per_user = per_user
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._by_user = Counter()
+        self._semaphore = None
+        self._loop = None
+
+    def admit(self, user_id):
+        if self._by_user[user_id] >= self.per_user or self.pending() >= self.max_running + self.max_queued:
+            self.rejected += 1
+            return False
+
+        self._by_user[user_id] += 1
+        self.admitted += 1
+        return True
+
+    def release(self, user_id):
+        self._by_user[user_id] -= 1
+        if self._by_user[user_id] <= 0:
+            del self._by_user[user_id]
+
+    @asynccontextmanager
+    async def slot(self):
+        # Espera turno entre los trabajos admitidos; como mucho max_running se ejecutan a la vez
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_running)
+            self._loop = loop
+
+        async with self._semaphore:
+            self.running += 1
+            try:
+                yield
+            finally:
+                self.running -= 1
+
+    def pending(self):
+        return sum(self._by_user.values())
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'queued': self.pending() - self.running,
+            'users': len(self._by_user),
+            'admitted': self.admitted,
+            'rejected': self.rejected
+        }
+
+
+jobs = JobQueue()
@@ -0,0 +1,358 @@
+import io
+import time
+import pandas as pd
+import pytz
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import select, insert, delete, or_
+from sqlalchemy.ext.asyncio import create_async_engine
+from postgres_create_table import RequestParams, Bars
+import market_calendar
+import config
+from config import postgres_user, postgres_password, postgres_host, postgres_port, postgres_db
+
+
+engine = create_async_engine(
+    f'postgresql+psycopg://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
+)
+
+EASTERN = pytz.timezone('US/Eastern')
+SESSION_TIMESPANS = ['minute', 'hour', 'day']
+# Cobertura de las barras diarias de todo el mercado (endpoint grouped daily)
+GROUPED_TICKER = '*'
+
+OPEN_BARS_TTL_SECONDS = getattr(config, 'open_bars_ttl_seconds', 60)
+
+
+def align_range(timespan, from_date, to_date):
+    # Extiende el rango a ventanas completas para no guardar barras parciales
+    start = date.fromisoformat(from_date)
+    end = date.fromisoformat(to_date)
+
+    if timespan == 'week':
+        start -= timedelta(days=(start.weekday() + 1) % 7)
+        end += timedelta(days=(5 - end.weekday()) % 7)
+    elif timespan == 'month':
+        start = start.replace(day=1)
+        end = (end.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    elif timespan == 'quarter':
+        start = date(start.year, 3 * ((start.month - 1) // 3) + 1, 1)
+        end = date(end.year, 3 * ((end.month - 1) // 3) + 3, 1)
+        end = (end + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    elif timespan == 'year':
+        start = date(start.year, 1, 1)
+        end = date(end.year, 12, 31)
+
+    return start.isoformat(), end.isoformat()
+
+
+def subtract_ranges(from_date, to_date, covered):
+    start = date.fromisoformat(from_date)
+    end = date.fromisoformat(to_date)
+    one_day = timedelta(days=1)
+
+    gaps = []
+    cursor = start
+    for covered_from, covered_to in sorted(covered):
+        covered_from = date.fromisoformat(covered_from)
+        covered_to = date.fromisoformat(covered_to)
+        if covered_to < cursor:
+            continue
+        if covered_from > end:
+            break
+        if covered_from > cursor:
+            gaps.append((cursor, covered_from - one_day))
+        cursor = covered_to + one_day
+        if cursor > end:
+            break
+
+    if cursor <= end:
+        gaps.append((cursor, end))
+
+    return [(gap_from.isoformat(), gap_to.isoformat()) for gap_from, gap_to in gaps]
+
+
+def open_tail_start(timespan):
+    # Primera fecha cuya ventana todavía puede cambiar
+    first_open = market_calendar.last_final_session() + timedelta(days=1)
+    return align_range(timespan, first_open.isoformat(), first_open.isoformat())[0]
+
+
+def includes_open_tail(timespan, to_date):
+    return align_range(timespan, to_date, to_date)[1] >= open_tail_start(timespan)
+
+
+def split_final(timespan, from_date, to_date):
+    open_start = open_tail_start(timespan)
+    parts = []
+    if from_date < open_start:
+        last_final = (date.fromisoformat(open_start) - timedelta(days=1)).isoformat()
+        parts.append((from_date, min(to_date, last_final), True))
+    if to_date >= open_start:
+        parts.append((max(from_date, open_start), to_date, False))
+    return parts
+
+
+def _window(from_date, to_date):
+    start = EASTERN.localize(datetime.strptime(from_date, '%Y-%m-%d'))
+    end = EASTERN.localize(datetime.strptime(to_date, '%Y-%m-%d') + timedelta(days=1))
+    return start, end
+
+
+async def find_missing_ranges(ticker, multiplier, timespan, from_date, to_date):
+    from_date, to_date = align_range(timespan, from_date, to_date)
+
+    try:
+        # Las filas antiguas con resultados propios no tienen sus barras en 'bars'
+        statement = select(RequestParams.from_date, RequestParams.to_date).where(
+            RequestParams.ticker == ticker,
+            RequestParams.multiplier == multiplier,
+            RequestParams.timespan == timespan,
+            RequestParams.from_date <= to_date,
+            RequestParams.to_date >= from_date,
+            ~RequestParams.results.any(),
+            or_(
+                RequestParams.is_final,
+                RequestParams.fetched_at >= datetime.now(timezone.utc) - timedelta(seconds=OPEN_BARS_TTL_SECONDS)
+            )
+        )
+        async with engine.connect() as connection:
+            rows = (await connection.execute(statement)).all()
+
+        gaps = subtract_ranges(from_date, to_date, [(row.from_date, row.to_date) for row in rows])
+
+        if timespan in SESSION_TIMESPANS:
+            # Fines de semana y feriados no tienen barras: no cuentan como faltantes
+            gaps = [gap for gap in (market_calendar.trim_to_sessions(*gap) for gap in gaps) if gap]
+
+        return gaps
+
+    except Exception as e:
+        print(f"Error al verificar caché: {e}")
+        return [(from_date, to_date)]
+
+
+async def read_bars(connection, ticker, multiplier, timespan, start, end):
+    # Una sola consulta por el índice único, volcada con COPY directo a columnas tipadas
+    buffer = io.BytesIO()
+    async with connection.cursor() as cursor:
+        async with cursor.copy("""
+            COPY (
+                SELECT (extract(epoch FROM timestamp) * 1000)::bigint, volume, open, close, high, low
+                FROM bars
+                WHERE ticker = %s AND multiplier = %s AND timespan = %s
+                  AND timestamp >= %s AND timestamp < %s
+                ORDER BY timestamp
+            ) TO STDOUT (FORMAT CSV)
+        """, (ticker, multiplier, timespan, start, end)) as copy:
+            async for data in copy:
+                buffer.write(data)
+    buffer.seek(0)
+
+    columns = ['t', 'volume', 'open', 'close', 'high', 'low']
+    dtypes = {'t': 'int64', 'volume': 'float64', 'open': 'float64', 'close': 'float64', 'high': 'float64', 'low': 'float64'}
+    if buffer.getbuffer().nbytes:
+        df = pd.read_csv(buffer, header=None, names=columns, dtype=dtypes)
+    else:
+        df = pd.DataFrame(columns=columns).astype(dtypes)
+
+    df.index = pd.DatetimeIndex(
+        pd.to_datetime(df.pop('t').to_numpy(), unit='ms', utc=True).tz_convert('US/Eastern'),
+        name='timestamp'
+    )
+    return df
+
+
+async def check_cache(ticker, multiplier, timespan, from_date, to_date):
+    start, end = _window(*align_range(timespan, from_date, to_date))
+
+    try:
+        async with engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            return await read_bars(raw_connection.driver_connection, ticker, multiplier, timespan, start, end)
+
+    except Exception as e:
+        print(f"Error al verificar caché: {e}")
+        return None
+
+
+async def read_daily_closes(tickers, from_date, to_date):
+    # Cierres diarios de muchos tickers en una sola consulta: columnas ticker, date, close
+    start, end = _window(from_date, to_date)
+    buffer = io.BytesIO()
+
+    try:
+        async with engine.connect() as connection:
+            raw_connection = await connection.get_raw_connection()
+            async with raw_connection.driver_connection.cursor() as cursor:
+                async with cursor.copy("""
+                    COPY (
+                        SELECT ticker, (timestamp AT TIME ZONE 'US/Eastern')::date, close
+                        FROM bars
+                        WHERE ticker = ANY(%s) AND multiplier = 1 AND timespan = 'day'
+                          AND timestamp >= %s AND timestamp < %s
+                    ) TO STDOUT (FORMAT CSV)
+                """, (list(tickers), start, end)) as copy:
+                    async for data in copy:
+                        buffer.write(data)
+
+    except Exception as e:
+        print(f"Error al leer cierres diarios: {e}")
+        return None
+
+    buffer.seek(0)
+    columns = ['ticker', 'date', 'close']
+    if not buffer.getbuffer().nbytes:
+        return pd.DataFrame(columns=columns).astype({'ticker': 'object', 'date': 'object', 'close': 'float64'})
+    return pd.read_csv(buffer, header=None, names=columns, dtype={'ticker': 'object', 'date': 'object', 'close': 'float64'})
+
+
+async def copy_grouped_bars(connection, day, df):
+    # Barras diarias de todos los tickers de una sesión, con el timestamp de inicio del día como en /v2/aggs
+    timestamp = EASTERN.localize(datetime.strptime(day, '%Y-%m-%d'))
+    payload = df[['ticker', 'volume', 'open', 'close', 'high', 'low']].to_csv(index=False, header=False)
+
+    async with connection.cursor() as cursor:
+        await cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS grouped_staging (
+                ticker varchar(10), volume float8, open float8, close float8, high float8, low float8
+            ) ON COMMIT DELETE ROWS
+        """)
+        async with cursor.copy("COPY grouped_staging (ticker, volume, open, close, high, low) FROM STDIN (FORMAT CSV)") as copy:
+            await copy.write(payload)
+        await cursor.execute("""
+            INSERT INTO bars (ticker, multiplier, timespan, timestamp, volume, open, close, high, low, fetched_at, is_final)
+            SELECT ticker, 1, 'day', %s, volume, open, close, high, low, now(), true
+            FROM grouped_staging
+            ON CONFLICT ON CONSTRAINT uq_bars_key DO UPDATE SET
+                volume = EXCLUDED.volume,
+                open = EXCLUDED.open,
+                close = EXCLUDED.close,
+                high = EXCLUDED.high,
+                low = EXCLUDED.low,
+                fetched_at = EXCLUDED.fetched_at,
+                is_final = EXCLUDED.is_final
+        """, (timestamp,))
+
+
+async def save_grouped(day, df):
+    # Una sesión cerrada de todo el mercado; la cobertura queda a nombre de GROUPED_TICKER
+    try:
+        async with engine.begin() as connection:
+            if not df.empty:
+                raw_connection = await connection.get_raw_connection()
+                await copy_grouped_bars(raw_connection.driver_connection, day, df)
+            await _write_coverage(connection, GROUPED_TICKER, 1, 'day', day, day)
+        return True
+
+    except Exception as e:
+        print(f"Error al guardar en caché: {e}")
+        return False
+
+
+async def copy_bars(connection, ticker, multiplier, timespan, df, open_start):
+    # Un solo COPY a una tabla temporal y un upsert en bloque, sin objetos ORM por fila
+    payload = pd.DataFrame({
+        't': df.index.as_unit('ms').asi8,
+        'volume': df['volume'].to_numpy(dtype='float64'),
+        'open': df['open'].to_numpy(dtype='float64'),
+        'close': df['close'].to_numpy(dtype='float64'),
+        'high': df['high'].to_numpy(dtype='float64'),
+        'low': df['low'].to_numpy(dtype='float64')
+    }).to_csv(index=False, header=False)
+
+    async with connection.cursor() as cursor:
+        await cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS bars_staging (
+                t bigint, volume float8, open float8, close float8, high float8, low float8
+            ) ON COMMIT DELETE ROWS
+        """)
+        async with cursor.copy("COPY bars_staging (t, volume, open, close, high, low) FROM STDIN (FORMAT CSV)") as copy:
+            await copy.write(payload)
+        await cursor.execute("""
+            INSERT INTO bars (ticker, multiplier, timespan, timestamp, volume, open, close, high, low, fetched_at, is_final)
+            SELECT %s, %s, %s, to_timestamp(t / 1000.0), volume, open, close, high, low, now(),
+                   to_timestamp(t / 1000.0) < %s
+            FROM bars_staging
+            ON CONFLICT ON CONSTRAINT uq_bars_key DO UPDATE SET
+                volume = EXCLUDED.volume,
+                open = EXCLUDED.open,
+                close = EXCLUDED.close,
+                high = EXCLUDED.high,
+                low = EXCLUDED.low,
+                fetched_at = EXCLUDED.fetched_at,
+                is_final = EXCLUDED.is_final
+        """, (ticker, multiplier, timespan, open_start))
+        # Un lote escribe varias series en la misma transacción: la tabla temporal se vacía para la siguiente
+        await cursor.execute("TRUNCATE bars_staging")
+
+
+async def _write_bars(connection, ticker, multiplier, timespan, df):
+    raw_connection = await connection.get_raw_connection()
+    open_start, _ = _window(open_tail_start(timespan), open_tail_start(timespan))
+    started = time.perf_counter()
+    await copy_bars(raw_connection.driver_connection, ticker, multiplier, timespan, df, open_start)
+    elapsed = time.perf_counter() - started
+    print(f"📥 {len(df)} barras copiadas en {elapsed:.3f}s ({len(df) / max(elapsed, 1e-9):,.0f} filas/s)")
+
+
+async def _write_coverage(connection, ticker, multiplier, timespan, from_date, to_date):
+    # La cobertura abierta anterior queda reemplazada por la de esta descarga
+    await connection.execute(delete(RequestParams).where(
+        RequestParams.ticker == ticker,
+        RequestParams.multiplier == multiplier,
+        RequestParams.timespan == timespan,
+        RequestParams.from_date <= to_date,
+        RequestParams.to_date >= from_date,
+        ~RequestParams.is_final,
+        ~RequestParams.results.any()
+    ))
+
+    await connection.execute(insert(RequestParams), [
+        {
+            'ticker': ticker,
+            'multiplier': multiplier,
+            'timespan': timespan,
+            'from_date': part_from,
+            'to_date': part_to,
+            'is_final': is_final
+        }
+        for part_from, part_to, is_final in split_final(timespan, from_date, to_date)
+    ])
+
+
+async def delete_series(ticker, multiplier, timespan):
+    # Borra las barras y la cobertura de una serie para que se vuelva a pedir completa (p. ej. tras un split)
+    try:
+        async with engine.begin() as connection:
+            await connection.execute(delete(Bars).where(
+                Bars.ticker == ticker,
+                Bars.multiplier == multiplier,
+                Bars.timespan == timespan
+            ))
+            await connection.execute(delete(RequestParams).where(
+                RequestParams.ticker == ticker,
+                RequestParams.multiplier == multiplier,
+                RequestParams.timespan == timespan,
+                ~RequestParams.results.any()
+            ))
+        return True
+
+    except Exception as e:
+        print(f"Error al borrar del caché: {e}")
+        return False
+
+
+async def write_batch(bars, coverage):
+    # Varias páginas de barras y sus coberturas en una sola transacción; los errores se propagan
+    # para que la cola de escritura reintente. Las barras van antes que las coberturas
+    async with engine.begin() as connection:
+        for ticker, multiplier, timespan, df in bars:
+            await _write_bars(connection, ticker, multiplier, timespan, df)
+
+        for ticker, multiplier, timespan, from_date, to_date in coverage:
+            from_date, to_date = align_range(timespan, from_date, to_date)
+            await _write_coverage(connection, ticker, multiplier, timespan, from_date, to_date)
+
+
+async def close():
+    await engine.dispose()
@@ -0,0 +1,137 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+
+
+RENDER_PROCESSES = getattr(config, 'chart_render_processes', None) or os.cpu_count() or 1
+
+# Salida del gráfico: tamaño, resolución y compresión de lo que se sube a Telegram
+CHART_FIGSIZE = getattr(config, 'chart_figsize', (12, 8))
+CHART_DPI = getattr(config, 'chart_dpi', 100)
+CHART_FORMAT = getattr(config, 'chart_format', 'png')
+CHART_PNG_COMPRESS_LEVEL = getattr(config, 'chart_png_compress_level', 6)
+CHART_JPEG_QUALITY = getattr(config, 'chart_jpeg_quality', 85)
+
+CHART_TYPES = ['candle', 'line']
+# Orden de las columnas en el arreglo que se envía a los procesos
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+_pool = None
+
+# Estado de cada proceso renderizador, cargado una sola vez en _init_worker
+_pd = None
+_mpf = None
+_style = None
+
+
+def _init_worker():
+    global _pd, _mpf, _style
+    import matplotlib
+    matplotlib.use('Agg')
+    import pandas
+    import mplfinance
+
+    mc = mplfinance.make_marketcolors(
+        up='green', down='red',
+        edge='inherit',
+        wick={'up': 'green', 'down': 'red'},
+        volume='in'
+    )
+
+    _pd = pandas
+    _mpf = mplfinance
+    _style = mplfinance.make_mpf_style(
+        marketcolors=mc,
+        gridstyle='-',
+        y_on_right=False
+    )
+
+
+def _ping():
+    return os.getpid()
+
+
+def _render(timestamps, values, tz, ticker, chart_type, figsize, dpi, image_format):
+    # Corre en el proceso renderizador: arreglos compactos de entrada, bytes de la imagen de salida
+    index = _pd.DatetimeIndex(timestamps, name='timestamp')
+    if tz:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    plot_df = _pd.DataFrame(values, index=index, columns=[col.capitalize() for col in COLUMNS])
+
+    if image_format == 'jpeg':
+        pil_kwargs = {'quality': CHART_JPEG_QUALITY}
+    else:
+        pil_kwargs = {'compress_level': CHART_PNG_COMPRESS_LEVEL}
+
+    buffer = io.BytesIO()
+    _mpf.plot(
+        plot_df,
+        type=chart_type,
+        style=_style,
+        volume=True,
+        title=f'{ticker} - Historical Prices',
+        ylabel='Price (USD)',
+        ylabel_lower='Volume',
+        savefig=dict(fname=buffer, format=image_format, dpi=dpi, pil_kwargs=pil_kwargs),
+        figsize=figsize
+    )
+    return buffer.getvalue()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: los procesos no heredan el event loop ni las conexiones abiertas del bot
+        _pool = ProcessPoolExecutor(
+            max_workers=RENDER_PROCESSES,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+    return _pool
+
+
+def start():
+    # Levanta todos los procesos al arrancar el bot para que el primer gráfico no pague la carga de matplotlib
+    pool = get_pool()
+    for _ in range(RENDER_PROCESSES):
+        pool.submit(_ping)
+
+
+def pack_bars(df):
+    index = df.index
+    tz = str(index.tz) if index.tz is not None else None
+    if tz:
+        index = index.tz_convert('UTC').tz_localize(None)
+    timestamps = index.to_numpy(dtype='datetime64[ns]')
+    values = df[COLUMNS].to_numpy(dtype='float64')
+    return timestamps, values, tz
+
+
+async def render(df, ticker, chart_type='candle', figsize=CHART_FIGSIZE, dpi=CHART_DPI, image_format=CHART_FORMAT):
+    global _pool
+    timestamps, values, tz = pack_bars(df)
+    loop = asyncio.get_running_loop()
+    try:
+        image = await loop.run_in_executor(
+            get_pool(), _render, timestamps, values, tz, ticker, chart_type, tuple(figsize), dpi, image_format
+        )
+    except BrokenProcessPool:
+        # Si un proceso murió se descarta el pool; el próximo gráfico crea uno nuevo
+        _pool = None
+        raise
+
+    # Buffer en memoria listo para bot.send_photo; el nombre le indica la extensión a Telegram
+    buffer = io.BytesIO(image)
+    buffer.name = f"{ticker}.{'jpg' if image_format == 'jpeg' else 'png'}"
+    return buffer
+
+
+async def close():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
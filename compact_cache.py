@@ -0,0 +1,83 @@
+from datetime import date, timedelta
+from sqlalchemy import create_engine, text
+from config import postgres_user, postgres_password, postgres_host, postgres_port, postgres_db
+
+
+def merge_ranges(ranges):
+    # Cada rango fusionado conserva el fetched_at más antiguo: la cobertura abierta vence igual que antes
+    merged = []
+    for from_date, to_date, fetched_at in sorted(ranges):
+        if merged and date.fromisoformat(from_date) <= date.fromisoformat(merged[-1][1]) + timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], to_date)
+            merged[-1][2] = min(merged[-1][2], fetched_at)
+        else:
+            merged.append([from_date, to_date, fetched_at])
+    return merged
+
+
+def compact_cache():
+    try:
+        engine = create_engine(
+            f'postgresql+psycopg://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
+        )
+
+        with engine.begin() as connection:
+            # Las columnas antiguas son 'timestamp without time zone' en la zona de la sesión
+            moved = connection.execute(text("""
+                INSERT INTO bars (ticker, multiplier, timespan, timestamp, volume, open, close, high, low)
+                SELECT DISTINCT ON (rp.ticker, rp.multiplier, rp.timespan, h.timestamp)
+                       rp.ticker, rp.multiplier, rp.timespan, h.timestamp::timestamptz,
+                       h.volume, h.open, h.close, h.high, h.low
+                FROM hist_prices_results h
+                JOIN request_params rp ON rp.id = h.request_id
+                ORDER BY rp.ticker, rp.multiplier, rp.timespan, h.timestamp, h.id DESC
+                ON CONFLICT ON CONSTRAINT uq_bars_key DO NOTHING
+            """)).rowcount
+            legacy = connection.execute(text("SELECT count(*) FROM hist_prices_results")).scalar()
+            connection.execute(text("TRUNCATE hist_prices_results"))
+            print(f"✅ {moved} barras movidas a 'bars' ({legacy} filas antiguas eliminadas)")
+
+            rows = connection.execute(text(
+                "SELECT ticker, multiplier, timespan, from_date, to_date, fetched_at, is_final FROM request_params"
+            )).all()
+
+            # Los rangos finales y los abiertos se fusionan por separado para no volver final una cola abierta
+            ranges = {}
+            for row in rows:
+                key = (row.ticker, row.multiplier, row.timespan, row.is_final)
+                ranges.setdefault(key, []).append((row.from_date, row.to_date, row.fetched_at))
+
+            merged = [
+                {
+                    'ticker': ticker,
+                    'multiplier': multiplier,
+                    'timespan': timespan,
+                    'from_date': from_date,
+                    'to_date': to_date,
+                    'fetched_at': fetched_at,
+                    'is_final': is_final
+                }
+                for (ticker, multiplier, timespan, is_final), key_ranges in ranges.items()
+                for from_date, to_date, fetched_at in merge_ranges(key_ranges)
+            ]
+
+            connection.execute(text("DELETE FROM request_params"))
+            if merged:
+                connection.execute(text("""
+                    INSERT INTO request_params (ticker, multiplier, timespan, from_date, to_date, fetched_at, is_final)
+                    VALUES (:ticker, :multiplier, :timespan, :from_date, :to_date, :fetched_at, :is_final)
+                """), merged)
+            print(f"✅ Rangos de caché compactados: {len(rows)} → {len(merged)}")
+
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text("VACUUM ANALYZE bars"))
+            connection.execute(text("VACUUM ANALYZE request_params"))
+
+    except Exception as error:
+        print(f"❌ Error al compactar el caché: {error}")
+
+
+if __name__ == "__main__":
+    print("🔧 Iniciando compactación del caché...")
+    compact_cache()
+    print("✅ Proceso completado!")
@@ -5,3 +5,88 @@ postgres_user = "postgres"
 postgres_host = "localhost"
 postgres_port = 5432
 postgres_db = "stocks_db"
+
+# Particiona la tabla de barras por año (recomendado con muchas barras intradía)
+postgres_partition_bars = False
+# Años por delante del actual con partición creada; correr postgres_create_table.py al menos una vez por año
+postgres_partition_years_ahead = 2
+
+# Caché en memoria (LRU) delante de Postgres
+memory_cache_max_bytes = 256 * 1024 * 1024
+memory_cache_max_entries = 2048
+memory_cache_ttl_seconds = 300
+
+# Segundos que se reutilizan las barras de la sesión en curso antes de volver a pedirlas
+open_bars_ttl_seconds = 60
+
+# Cliente HTTP de Polygon (segundos y conexiones keep-alive)
+polygon_connect_timeout = 3.05
+polygon_read_timeout = 20
+polygon_pool_size = 16
+
+# Límite de la API key de Polygon (5 por minuto en el plan gratuito)
+polygon_requests_per_minute = 5
+polygon_burst = 5
+
+# Control de carga del bot: trabajos simultáneos por usuario, en ejecución y en cola
+bot_max_jobs_per_user = 1
+bot_max_running_jobs = 4
+bot_max_queued_jobs = 16
+
+# Procesos renderizadores de gráficos (None = uno por núcleo)
+chart_render_processes = None
+
+# Imagen del gráfico: tamaño en pulgadas, DPI y compresión ('png' o 'jpeg')
+chart_figsize = (12, 8)
+chart_dpi = 100
+chart_format = 'png'
+chart_png_compress_level = 6
+chart_jpeg_quality = 85
+
+# Gráficos ya enviados: se reutiliza el file_id de Telegram en pedidos idénticos
+chart_cache_max_entries = 4096
+chart_cache_ttl_seconds = 24 * 60 * 60
+
+# Máximo de velas / puntos de línea dibujados; con más barras el gráfico se reduce
+chart_max_candles = 400
+chart_max_line_points = 1000
+
+# Barras por página en las consultas de agregados (máximo de Polygon: 50000)
+polygon_page_limit = 50000
+# Tope de barras por consulta (acota la memoria de los rangos intradía largos)
+max_bars_per_request = 250000
+
+# Métricas internas: intervalo del log periódico en segundos (0 lo desactiva) y usuarios que pueden usar /Stats
+metrics_log_interval_seconds = 300
+admin_user_ids = []
+
+# Minutos de margen tras el after-hours (20:00 ET) antes de guardar la barra diaria como definitiva
+session_final_grace_minutes = 60
+
+# Escritura diferida al caché de Postgres (cola en segundo plano)
+write_behind_max_rows = 500000
+write_behind_batch_items = 64
+write_behind_flush_interval_seconds = 0.5
+write_behind_max_attempts = 5
+write_behind_retry_delay_seconds = 1
+
+# Indicadores del análisis SMA (la tendencia siempre usa SMA 50 / SMA 200)
+sma_windows = [20, 50, 100, 200]
+ema_windows = [20, 50]
+bollinger_window = 20
+bollinger_width = 2.0
+
+# Reporte de cruces SMA 50 / SMA 200: sesiones revisadas y ventana para la tendencia del spread
+sma_cross_history_days = 1260
+sma_cross_spread_sessions = 10
+
+# Screener: sesiones por ticker, tope de tickers por consulta y watchlists con nombre
+screener_sessions = 250
+screener_max_tickers = 600
+# Con más sesiones faltantes que estas, la carga del mercado completo se hace en segundo plano
+screener_inline_sessions = 5
+# Con más tickers sin historial guardado que estos, la carga por ticker también se hace en segundo plano
+screener_inline_tickers = 10
+screener_watchlists = {
+    'mag7': ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'NVDA', 'META', 'TSLA']
+}
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import config
+
+
+# Tope de elementos dibujados en un gráfico de 12x8: más velas o puntos no se distinguen en la imagen
+MAX_CANDLES = getattr(config, 'chart_max_candles', 400)
+MAX_LINE_POINTS = getattr(config, 'chart_max_line_points', 1000)
+
+
+def bucket_size(bars, max_bars):
+    return max(1, -(-bars // max_bars))
+
+
+def plotted_size(bars, chart_type):
+    if chart_type == 'line':
+        return min(bars, MAX_LINE_POINTS)
+    return -(-bars // bucket_size(bars, MAX_CANDLES))
+
+
+def bucket_bars(df, max_bars=MAX_CANDLES):
+    # Agrupa barras consecutivas en velas de k barras: apertura de la primera, cierre de la última,
+    # máximo de los máximos, mínimo de los mínimos y suma del volumen
+    size = bucket_size(len(df), max_bars)
+    if size == 1:
+        return df
+
+    starts = np.arange(0, len(df), size)
+    return pd.DataFrame({
+        'volume': np.add.reduceat(df['volume'].to_numpy(dtype='float64'), starts),
+        'open': df['open'].to_numpy()[starts],
+        'close': df['close'].to_numpy()[np.append(starts[1:] - 1, len(df) - 1)],
+        'high': np.maximum.reduceat(df['high'].to_numpy(dtype='float64'), starts),
+        'low': np.minimum.reduceat(df['low'].to_numpy(dtype='float64'), starts)
+    }, index=df.index[starts])
+
+
+def lttb(y, threshold):
+    # Largest-Triangle-Three-Buckets: índices de los puntos que conservan la forma de la serie.
+    # Las x son posiciones porque mplfinance dibuja una barra por posición, sin huecos de mercado cerrado
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype='float64')
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    selected = np.empty(threshold, dtype='int64')
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def lttb_bars(df, max_points=MAX_LINE_POINTS):
+    selected = lttb(df['close'].to_numpy(dtype='float64'), max_points)
+    if len(selected) == len(df):
+        return df
+
+    bars = df.iloc[selected].copy()
+    # Cada punto se queda con el volumen de todas las barras hasta el siguiente punto elegido
+    bars['volume'] = np.add.reduceat(df['volume'].to_numpy(dtype='float64'), selected)
+    return bars
+
+
+def downsample(df, chart_type):
+    if chart_type == 'line':
+        return lttb_bars(df)
+    return bucket_bars(df)
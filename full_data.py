@@ -1,57 +1,71 @@
-import requests
-from datetime import datetime, timedelta
-from config import api_key
+import asyncio
+from datetime import datetime
+import polygon_client
+from market_calendar import last_final_session, sessions_back
 from utils import format_price, format_large_number
+from memory_cache import cache
+from runtime import run
+from single_flight import single_flight
 
 
-def fetch_ticker_details(ticker):
-    url = f"https://api.polygon.io/v3/reference/tickers/{ticker}"
-    params = {
-        'apiKey': api_key
-    }
+@single_flight(lambda ticker: (ticker.strip().upper(),))
+async def fetch_ticker_details(ticker):
+    path = f"/v3/reference/tickers/{ticker}"
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = await polygon_client.get_json(path)
         if data.get('status') == 'OK' and 'results' in data:
             return data['results']
         else:
             return None
-    except requests.exceptions.RequestException as e:
+    except polygon_client.REQUEST_ERRORS as e:
         print(f"❌ Error al obtener detalles: {e}")
         return None
 
 
-def fetch_latest_quote(ticker):
-    to_date = datetime.now() - timedelta(days=1)
-    from_date = to_date - timedelta(days=10)
-    url = f"https://api.polygon.io/v2/aggs/ticker/{ticker}/range/1/day/{from_date.strftime('%Y-%m-%d')}/{to_date.strftime('%Y-%m-%d')}"
+# Sesiones hacia atrás en las que se busca la última barra (tickers sin operaciones o sesión aún no publicada)
+QUOTE_LOOKBACK_SESSIONS = 10
+
+
+@single_flight(lambda ticker: (ticker.strip().upper(),))
+async def fetch_latest_quote(ticker):
+    # La barra más reciente hasta la última sesión cerrada según el calendario de la NYSE
+    to_date = last_final_session()
+    from_date = sessions_back(QUOTE_LOOKBACK_SESSIONS, to_date)
+    
+    cache_key = ('quote', ticker, to_date.strftime('%Y-%m-%d'))
+    quote = cache.get(cache_key)
+    if quote is not None:
+        print(f"⚡ Cotización de {ticker} encontrada en memoria")
+        return quote
+    
+    path = f"/v2/aggs/ticker/{ticker}/range/1/day/{from_date.strftime('%Y-%m-%d')}/{to_date.strftime('%Y-%m-%d')}"
     params = {
         'adjusted': 'true',
         'sort': 'desc',
-        'limit': 1,
-        'apiKey': api_key
+        'limit': 1
     }
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = await polygon_client.get_json(path, params)
         print(f"📡 Full Data API Response status: {data.get('status')}")
         print(f"📊 Full Data Results count: {len(data.get('results', []))}")
-        if data.get('status') == 'OK' and 'results' in data and len(data['results']) > 0:
+        # DELAYED: planes con datos diferidos
+        if data.get('status') in ('OK', 'DELAYED') and len(data.get('results', [])) > 0:
+            cache.set(cache_key, data['results'][0])
             return data['results'][0]
         else:
             print(f"⚠️ Full Data - No data: {data.get('status')}")
             return None
-    except requests.exceptions.RequestException as e:
+    except polygon_client.REQUEST_ERRORS as e:
         print(f"❌ Error al obtener cotización: {e}")
         return None
 
 
-def get_full_data(ticker):
+async def get_full_data(ticker):
     print(f"📋 Obteniendo datos completos para {ticker}...")
-    details = fetch_ticker_details(ticker)
-    quote = fetch_latest_quote(ticker)
+    details, quote = await asyncio.gather(
+        fetch_ticker_details(ticker),
+        fetch_latest_quote(ticker)
+    )
     
     if quote is None:
         return f"❌ No se pudieron obtener datos para {ticker}. Verifica que el ticker sea válido."
@@ -117,5 +131,5 @@ def get_full_data(ticker):
 
 
 if __name__ == "__main__":
-    data = get_full_data('AAPL')
+    data = run(get_full_data('AAPL'))
     print(data)
@@ -1,224 +1,228 @@
-import os
-import requests
+import hashlib
 import pandas as pd
-import mplfinance as mpf
-from datetime import datetime
 import pytz
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from postgres_create_table import RequestParams, HistPricesResults
-from config import api_key, postgres_user, postgres_password, postgres_host, postgres_port, postgres_db
+from bar_store import align_range, find_missing_ranges, check_cache, includes_open_tail, OPEN_BARS_TTL_SECONDS
+from memory_cache import cache, chart_file_ids
+from resample import resample_bars, RESAMPLED_TIMESPANS
+import polygon_client
+import chart_renderer
+from downsample import downsample, plotted_size
+from single_flight import single_flight
+from market_calendar import count_sessions, last_final_session, previous_session
+from write_behind import writer
+import config
 
 
-engine = create_engine(
-    f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
-)
-Session = sessionmaker(bind=engine)
+# Barras por página de Polygon (máximo permitido: 50000)
+PAGE_LIMIT = getattr(config, 'polygon_page_limit', 50000)
+# Tope de barras por consulta: las páginas se juntan en un solo DataFrame, así la memoria queda acotada
+MAX_BARS = getattr(config, 'max_bars_per_request', 250000)
+# Barras por sesión con horario extendido (4:00 a 20:00)
+BARS_PER_SESSION = {'minute': 960, 'hour': 16, 'day': 1}
 
 
-def check_cache(ticker, multiplier, timespan, from_date, to_date):
+def estimated_bars(multiplier, timespan, from_date, to_date):
+    # Cota superior de barras del rango; semanas, meses, trimestres y años salen de las diarias
+    per_session = BARS_PER_SESSION.get(timespan, 1) / (multiplier if timespan in BARS_PER_SESSION else 1)
+    return int(count_sessions(from_date, to_date) * per_session)
 
-    session = Session()
-    try:
-        request = session.query(RequestParams).filter_by(
-            ticker=ticker,
-            multiplier=multiplier,
-            timespan=timespan,
-            from_date=from_date,
-            to_date=to_date
-        ).first()
-        
-        if request:
-            results = session.query(HistPricesResults).filter_by(
-                request_id=request.id
-            ).all()
-            
-            if results:
-                data = []
-                for result in results:
-                    data.append({
-                        'timestamp': result.timestamp,
-                        'volume': result.volume,
-                        'open': result.open,
-                        'close': result.close,
-                        'high': result.high,
-                        'low': result.low
-                    })
-                
-                df = pd.DataFrame(data)
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
-                df.set_index('timestamp', inplace=True)
-                
-                return df
-        
-        return None
-        
-    except Exception as e:
-        print(f"Error al verificar caché: {e}")
-        return None
-    finally:
-        session.close()
 
+def bars_from_results(results):
 
-def save_to_cache(ticker, multiplier, timespan, from_date, to_date, df):
+    df = pd.DataFrame(results, columns=['t', 'v', 'o', 'c', 'h', 'l'])
+    
+    df['timestamp'] = pd.to_datetime(df['t'], unit='ms')
+    
+    df['timestamp'] = df['timestamp'].dt.tz_localize('UTC').dt.tz_convert('US/Eastern')
+    
+    df = df.rename(columns={
+        'v': 'volume',
+        'o': 'open',
+        'c': 'close',
+        'h': 'high',
+        'l': 'low'
+    })
+    
+    df = df[['timestamp', 'volume', 'open', 'close', 'high', 'low']].astype({
+        'volume': 'float64', 'open': 'float64', 'close': 'float64', 'high': 'float64', 'low': 'float64'
+    })
+    df.set_index('timestamp', inplace=True)
+    
+    return df
 
-    session = Session()
-    try:
-        request_params = RequestParams(
-            ticker=ticker,
-            multiplier=multiplier,
-            timespan=timespan,
-            from_date=from_date,
-            to_date=to_date
-        )
-        session.add(request_params)
-        session.flush()
+
+async def stream_from_polygon(ticker, multiplier, timespan, from_date, to_date):
+    # Genera una página de barras por respuesta siguiendo next_url; solo una página cruda vive en memoria.
+    # Si una página falla se genera None y la descarga se corta
+
+    path = f"/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{from_date}/{to_date}"
+    
+    params = {
+        'adjusted': 'true',
+        'sort': 'asc',
+        'limit': PAGE_LIMIT
+    }
+    
+    while path:
+        try:
+            data = await polygon_client.get_json(path, params)
+        except polygon_client.REQUEST_ERRORS as e:
+            print(f"❌ Error en la solicitud: {e}")
+            yield None
+            return
         
-        for index, row in df.iterrows():
-            result = HistPricesResults(
-                request_id=request_params.id,
-                timestamp=index.to_pydatetime(),
-                volume=float(row['volume']),
-                open=float(row['open']),
-                close=float(row['close']),
-                high=float(row['high']),
-                low=float(row['low'])
-            )
-            session.add(result)
+        # DELAYED: planes con datos diferidos (habitual en barras intradía recientes)
+        if data.get('status') not in ('OK', 'DELAYED'):
+            print(f"⚠️ No se encontraron datos: {data.get('status')}")
+            yield None
+            return
         
-        session.commit()
-        print("✅ Datos guardados en caché")
+        yield bars_from_results(data.get('results', []))
         
-    except Exception as e:
-        session.rollback()
-        print(f"Error al guardar en caché: {e}")
-    finally:
-        session.close()
+        # next_url ya trae el cursor y los parámetros de la consulta
+        path = data.get('next_url')
+        params = None
 
 
-def fetch_historical_prices(ticker, multiplier, timespan, from_date, to_date):
+def covered_until(gap_from, gap_to, last_bar_day):
+    # La última sesión cerrada solo queda cubierta si llegó una barra suya: Polygon puede publicarla tarde
+    # y una cobertura final sin esa barra no se volvería a pedir nunca
+    last_final = last_final_session().isoformat()
+    if not gap_from <= last_final <= gap_to or (last_bar_day is not None and last_bar_day >= last_final):
+        return gap_to
+    return previous_session(last_final, inclusive=False).isoformat()
 
-    print("🔍 Verificando caché...")
-    cached_data = check_cache(ticker, multiplier, timespan, from_date, to_date)
-    
-    if cached_data is not None:
-        print("✅ Datos encontrados en caché!")
-        return cached_data
+
+@single_flight(lambda ticker, multiplier, timespan, from_date, to_date: (ticker.strip().upper(), int(multiplier), timespan, from_date, to_date))
+async def fetch_historical_prices(ticker, multiplier, timespan, from_date, to_date):
+
+    cache_key = ('aggs', ticker, multiplier, timespan, from_date, to_date)
+    df = cache.get(cache_key)
+    if df is not None:
+        print("⚡ Datos encontrados en memoria!")
+        return df
     
-    print("📡 Consultando API de Polygon.io...")
+    # Los rangos con la sesión en curso se refrescan en memoria con el mismo TTL que en Postgres
+    ttl_seconds = OPEN_BARS_TTL_SECONDS if includes_open_tail(timespan, to_date) else None
     
-    url = f"https://api.polygon.io/v2/aggs/ticker/{ticker}/range/{multiplier}/{timespan}/{from_date}/{to_date}"
+    if timespan in RESAMPLED_TIMESPANS:
+        # Semanas, meses, trimestres y años se arman con las barras diarias del caché
+        day_from, day_to = align_range(timespan, from_date, to_date)
+        daily = await fetch_historical_prices(ticker, 1, 'day', day_from, day_to)
+        if daily is None:
+            return None
+        
+        df = resample_bars(daily, multiplier, timespan, day_from)
+        print(f"🧮 {len(df)} barras de {multiplier} {timespan} calculadas a partir de {len(daily)} barras diarias")
+        cache.set(cache_key, df, ttl_seconds)
+        return df
     
-    params = {
-        'adjusted': 'true',
-        'sort': 'asc',
-        'apiKey': api_key
-    }
+    print("🔍 Verificando caché...")
+    missing_ranges = await find_missing_ranges(ticker, multiplier, timespan, from_date, to_date)
     
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
+    frames = []
+    if missing_ranges != [align_range(timespan, from_date, to_date)]:
+        cached_data = await check_cache(ticker, multiplier, timespan, from_date, to_date)
         
-        data = response.json()
-        
-        if data.get('status') == 'OK' and 'results' in data:
-            df = pd.DataFrame(data['results'])
-            
-            df['timestamp'] = pd.to_datetime(df['t'], unit='ms')
-            
-            df['timestamp'] = df['timestamp'].dt.tz_localize('UTC').dt.tz_convert('US/Eastern')
-            
-            df = df.rename(columns={
-                'v': 'volume',
-                'o': 'open',
-                'c': 'close',
-                'h': 'high',
-                'l': 'low'
-            })
-            
-            df = df[['timestamp', 'volume', 'open', 'close', 'high', 'low']]
-            df.set_index('timestamp', inplace=True)
-            
-            save_to_cache(ticker, multiplier, timespan, from_date, to_date, df)
-            
-            return df
+        if cached_data is None:
+            missing_ranges = [align_range(timespan, from_date, to_date)]
+        elif not missing_ranges:
+            print("✅ Datos encontrados en caché!")
+            if cached_data.empty:
+                return None
+            cache.set(cache_key, cached_data, ttl_seconds)
+            return cached_data
         else:
-            print(f"⚠️ No se encontraron datos: {data.get('status')}")
-            return None
+            frames.append(cached_data)
+    
+    for gap_from, gap_to in missing_ranges:
+        print(f"📡 Consultando API de Polygon.io ({gap_from} a {gap_to})...")
+        pages = 0
+        bars = sum(len(frame) for frame in frames)
+        last_bar_day = None
+        
+        # Cada página se encola para guardarse en segundo plano; la cobertura se encola solo si llegaron todas
+        async for page in stream_from_polygon(ticker, multiplier, timespan, gap_from, gap_to):
+            if page is None:
+                return None
             
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error en la solicitud: {e}")
+            pages += 1
+            bars += len(page)
+            if bars > MAX_BARS:
+                # Las páginas ya encoladas se guardan, pero sin cobertura el rango se vuelve a pedir
+                print(f"⚠️ Rango demasiado grande: más de {MAX_BARS:,} barras")
+                return None
+            await writer.enqueue_bars(ticker, multiplier, timespan, page)
+            frames.append(page)
+            if not page.empty:
+                last_bar_day = page.index[-1].strftime('%Y-%m-%d')
+        
+        if pages > 1:
+            print(f"📄 {pages} páginas recibidas de Polygon")
+        coverage_to = covered_until(gap_from, gap_to, last_bar_day)
+        if coverage_to >= gap_from:
+            await writer.enqueue_coverage(ticker, multiplier, timespan, gap_from, coverage_to)
+    
+    df = pd.concat(frames)
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    
+    if df.empty:
+        print("⚠️ No se encontraron datos en el rango solicitado")
         return None
+    
+    cache.set(cache_key, df, ttl_seconds)
+    return df
 
 
-def generate_chart(df, ticker, chart_type='candle', output_path='periodic_historical_fig/chart.png'):
+async def generate_chart(df, ticker, chart_type='candle'):
 
+    if chart_type not in chart_renderer.CHART_TYPES:
+        print(f"❌ Tipo de gráfico inválido: {chart_type}")
+        return None
+    
     try:
-        mc = mpf.make_marketcolors(
-            up='green', down='red',
-            edge='inherit',
-            wick={'up': 'green', 'down': 'red'},
-            volume='in'
-        )
-        
-        s = mpf.make_mpf_style(
-            marketcolors=mc,
-            gridstyle='-',
-            y_on_right=False
-        )
-        
-        plot_df = df.copy()
-        plot_df.columns = [col.capitalize() for col in plot_df.columns]
-        
-        if chart_type == 'candle':
-            mpf.plot(
-                plot_df,
-                type='candle',
-                style=s,
-                volume=True,
-                title=f'{ticker} - Historical Prices',
-                ylabel='Price (USD)',
-                ylabel_lower='Volume',
-                savefig=output_path,
-                figsize=(12, 8)
-            )
-        elif chart_type == 'line':
-            mpf.plot(
-                plot_df,
-                type='line',
-                style=s,
-                volume=True,
-                title=f'{ticker} - Historical Prices',
-                ylabel='Price (USD)',
-                ylabel_lower='Volume',
-                savefig=output_path,
-                figsize=(12, 8)
-            )
-        else:
-            print(f"❌ Tipo de gráfico inválido: {chart_type}")
-            return None
-        
-        print(f"✅ Gráfico guardado en: {output_path}")
-        return output_path
+        chart = await chart_renderer.render(downsample(df, chart_type), ticker, chart_type)
+        print(f"✅ Gráfico generado en memoria ({len(chart.getbuffer()) / 1024:.0f} KB)")
+        return chart
         
     except Exception as e:
         print(f"❌ Error al generar gráfico: {e}")
         return None
 
 
-def get_historical_prices_chart(ticker, multiplier, timespan, from_date, to_date, chart_type='candle'):
+def bars_hash(df):
+    hashed = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return hashlib.blake2b(hashed.tobytes(), digest_size=16).hexdigest()
+
 
-    df = fetch_historical_prices(ticker, multiplier, timespan, from_date, to_date)
+async def get_historical_prices_chart(ticker, multiplier, timespan, from_date, to_date, chart_type='candle'):
+
+    df = await fetch_historical_prices(ticker, multiplier, timespan, from_date, to_date)
     
     if df is None or df.empty:
-        return None
+        return None, None, None
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_path = f'periodic_historical_fig/{ticker}_{timestamp}.png'
+    # (barras, elementos dibujados) cuando el gráfico se reduce para no dibujar de más
+    plotted = plotted_size(len(df), chart_type)
+    sampling = (len(df), plotted) if plotted < len(df) else None
     
-    chart_path = generate_chart(df, ticker, chart_type, output_path)
+    # Mismo pedido y mismas barras: se responde con el file_id que Telegram devolvió la primera vez
+    chart_key = ('chart', ticker, multiplier, timespan, from_date, to_date, chart_type, bars_hash(df))
+    file_id = chart_file_ids.get(chart_key)
+    if file_id is not None:
+        print("⚡ Gráfico ya enviado antes, se reutiliza su file_id")
+        return file_id, chart_key, sampling
     
-    return chart_path
+    # El renderizado corre en el pool de procesos de chart_renderer y vuelve como buffer en memoria
+    return await generate_chart(df, ticker, chart_type), chart_key, sampling
+
+
+def remember_chart(chart_key, file_id):
+    chart_file_ids.set(chart_key, file_id)
+
+
+def forget_chart(chart_key):
+    chart_file_ids.invalidate(chart_key)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+
+# Todas las funciones reciben cierres en orden cronológico sobre el último eje: un arreglo por ticker
+# o una matriz (tickers x sesiones). Devuelven series completas de la misma forma, con NaN donde la
+# ventana todavía no tiene datos suficientes o contiene cierres faltantes (NaN)
+
+
+def _prefix_sums(close):
+    # Sumas acumuladas con un cero inicial: la suma de x[..., i:j] es sums[..., j] - sums[..., i].
+    # Se restan del primer cierre válido de cada fila para no perder precisión al restar acumulados
+    # grandes, y los NaN suman cero pero no cuentan en 'counts'
+    valid = ~np.isnan(close)
+    if close.shape[-1]:
+        first = np.take_along_axis(close, valid.argmax(axis=-1)[..., None], axis=-1)
+        first = np.where(np.isnan(first), 0.0, first)
+    else:
+        first = np.zeros(close.shape[:-1] + (1,))
+    shifted = np.where(valid, close - first, 0.0)
+
+    zeros = np.zeros(close.shape[:-1] + (1,))
+    sums = np.concatenate((zeros, np.cumsum(shifted, axis=-1)), axis=-1)
+    squares = np.concatenate((zeros, np.cumsum(shifted * shifted, axis=-1)), axis=-1)
+    weighted = np.concatenate((zeros, np.cumsum(np.arange(close.shape[-1]) * shifted, axis=-1)), axis=-1)
+    counts = np.concatenate((zeros, np.cumsum(valid, axis=-1)), axis=-1)
+    return first, sums, squares, weighted, counts
+
+
+def _windowed(prefix, window):
+    return prefix[..., window:] - prefix[..., :-window]
+
+
+def _empty(close):
+    return np.full(close.shape, np.nan)
+
+
+def _sma(close, prefix, window):
+    first, sums, _, _, counts = prefix
+    out = _empty(close)
+    if 0 < window <= close.shape[-1]:
+        full = _windowed(counts, window) == window
+        out[..., window - 1:] = np.where(full, _windowed(sums, window) / window + first, np.nan)
+    return out
+
+
+def _std(close, prefix, window):
+    # Desviación estándar poblacional (ddof=0), la que usan las bandas de Bollinger
+    _, sums, squares, _, counts = prefix
+    out = _empty(close)
+    if 0 < window <= close.shape[-1]:
+        full = _windowed(counts, window) == window
+        mean = _windowed(sums, window) / window
+        variance = np.maximum(_windowed(squares, window) / window - mean ** 2, 0.0)
+        out[..., window - 1:] = np.where(full, np.sqrt(variance), np.nan)
+    return out
+
+
+def _wma(close, prefix, window):
+    # Pesos lineales 1..window (el cierre más reciente pesa más):
+    # sum(k * x_k) - (t - window) * sum(x_k) sobre la ventana que termina en t
+    first, sums, _, weighted, counts = prefix
+    out = _empty(close)
+    if 0 < window <= close.shape[-1]:
+        full = _windowed(counts, window) == window
+        ends = np.arange(window - 1, close.shape[-1])
+        total = _windowed(sums, window)
+        values = (_windowed(weighted, window) - (ends - window) * total) / (window * (window + 1) / 2) + first
+        out[..., window - 1:] = np.where(full, values, np.nan)
+    return out
+
+
+def _ema(close, prefix, window):
+    # Arranca con la SMA de la primera ventana completa de cada fila y sigue con alpha = 2 / (window + 1)
+    out = _empty(close)
+    if not 0 < window <= close.shape[-1]:
+        return out
+
+    rows = close.reshape(-1, close.shape[-1])
+    smas = _sma(close, prefix, window).reshape(rows.shape)
+    started = ~np.isnan(smas)
+    seeds = started.argmax(axis=-1)
+
+    seeded = np.where(np.arange(rows.shape[-1]) > seeds[:, None], rows, np.nan)
+    seeded[np.arange(len(rows)), seeds] = smas[np.arange(len(rows)), seeds]
+    seeded[~started.any(axis=-1)] = np.nan
+
+    ema = pd.DataFrame(seeded.T).ewm(span=window, adjust=False).mean().to_numpy().T
+    return np.where(np.arange(rows.shape[-1]) >= seeds[:, None], ema, np.nan).reshape(close.shape)
+
+
+def sma(close, windows):
+    close = np.asarray(close, dtype='float64')
+    prefix = _prefix_sums(close)
+    return {window: _sma(close, prefix, window) for window in windows}
+
+
+def ema(close, windows):
+    close = np.asarray(close, dtype='float64')
+    prefix = _prefix_sums(close)
+    return {window: _ema(close, prefix, window) for window in windows}
+
+
+def wma(close, windows):
+    close = np.asarray(close, dtype='float64')
+    prefix = _prefix_sums(close)
+    return {window: _wma(close, prefix, window) for window in windows}
+
+
+def rolling_std(close, windows):
+    close = np.asarray(close, dtype='float64')
+    prefix = _prefix_sums(close)
+    return {window: _std(close, prefix, window) for window in windows}
+
+
+def bollinger(close, window=20, width=2.0):
+    close = np.asarray(close, dtype='float64')
+    prefix = _prefix_sums(close)
+    middle = _sma(close, prefix, window)
+    deviation = width * _std(close, prefix, window)
+    return middle, middle + deviation, middle - deviation
+
+
+def compute(close, sma_windows=(), ema_windows=(), wma_windows=(), std_windows=()):
+    # Todas las series pedidas con una sola pasada de sumas acumuladas sobre los cierres
+    close = np.asarray(close, dtype='float64')
+    prefix = _prefix_sums(close)
+    return {
+        'sma': {window: _sma(close, prefix, window) for window in sma_windows},
+        'ema': {window: _ema(close, prefix, window) for window in ema_windows},
+        'wma': {window: _wma(close, prefix, window) for window in wma_windows},
+        'std': {window: _std(close, prefix, window) for window in std_windows}
+    }
+
+
+def crossovers(fast, slow):
+    # Cruces de 'fast' sobre 'slow' en una pasada vectorizada: devuelve (índices, direcciones),
+    # con dirección +1 cuando fast pasa por encima (golden cross) y -1 cuando pasa por debajo (death cross)
+    spread = np.asarray(fast, dtype='float64') - np.asarray(slow, dtype='float64')
+    valid = np.flatnonzero(~np.isnan(spread))
+    signs = np.sign(spread[valid])
+
+    # Un spread exactamente cero mantiene el signo anterior: no cuenta como cruce por sí solo
+    last_nonzero = np.maximum.accumulate(np.where(signs != 0, np.arange(len(signs)), 0))
+    signs = signs[last_nonzero]
+
+    changes = np.flatnonzero((signs[1:] != signs[:-1]) & (signs[:-1] != 0)) + 1
+    return valid[changes], signs[changes].astype('int64')
@@ -7,7 +7,10 @@ def main_menu():
     btn2 = types.KeyboardButton("📊 SMA Analysis")
     btn3 = types.KeyboardButton("📋 Full Data")
     btn4 = types.KeyboardButton("ℹ️ Guide")
+    btn5 = types.KeyboardButton("🔀 SMA Crosses")
+    btn6 = types.KeyboardButton("🧮 Screener")
     markup.add(btn1, btn2)
+    markup.add(btn5, btn6)
     markup.add(btn3, btn4)
     return markup
 
@@ -22,13 +25,16 @@ def chart_type_keyboard():
 
 def period_keyboard():
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True, row_width=3)
-    btn1 = types.KeyboardButton("day")
-    btn2 = types.KeyboardButton("week")
-    btn3 = types.KeyboardButton("month")
-    btn4 = types.KeyboardButton("quarter")
-    btn5 = types.KeyboardButton("year")
+    btn1 = types.KeyboardButton("minute")
+    btn2 = types.KeyboardButton("hour")
+    btn3 = types.KeyboardButton("day")
+    btn4 = types.KeyboardButton("week")
+    btn5 = types.KeyboardButton("month")
+    btn6 = types.KeyboardButton("quarter")
+    btn7 = types.KeyboardButton("year")
     markup.add(btn1, btn2, btn3)
-    markup.add(btn4, btn5)
+    markup.add(btn4, btn5, btn6)
+    markup.add(btn7)
     return markup
 
 
@@ -1,16 +1,23 @@
-import os
 from telebot.async_telebot import AsyncTeleBot
 from telebot import types
+from telebot.asyncio_helper import ApiTelegramException
 from telebot.asyncio_handler_backends import State, StatesGroup
 from telebot.asyncio_storage import StateMemoryStorage
 import asyncio
+import io
 
 from config import bot_token
 import keyboard
 import utils
-from historical_prices import get_historical_prices_chart
-from sma import get_sma_analysis
+from historical_prices import get_historical_prices_chart, remember_chart, forget_chart, estimated_bars, MAX_BARS
+from sma import get_sma_analysis, get_sma_crossovers
 from full_data import get_full_data
+from screener import get_screener, resolve_watchlist, TOP_ROWS
+from runtime import close_resources
+import chart_renderer
+from rate_limiter import request_context, INTERACTIVE
+from admission import jobs
+import metrics
 
 state_storage = StateMemoryStorage()
 bot = AsyncTeleBot(bot_token, state_storage=state_storage)
@@ -28,9 +35,17 @@ class SMAStates(StatesGroup):
     ticker = State()
 
 
+class SMACrossStates(StatesGroup):
+    ticker = State()
+
+
 class FullDataStates(StatesGroup):
     ticker = State()
 
+
+class ScreenerStates(StatesGroup):
+    tickers = State()
+
 @bot.message_handler(commands=['start'])
 async def start_command(message):
     await bot.send_message(
@@ -50,6 +65,14 @@ async def guide_command(message):
     )
 
 
+@bot.message_handler(commands=['Stats'])
+async def stats_command(message):
+    # Métricas internas (cola de escritura, caché, Polygon, trabajos) solo para administradores
+    if not metrics.is_admin(message.from_user.id):
+        return
+    await bot.send_message(message.chat.id, metrics.format_metrics())
+
+
 @bot.message_handler(commands=['Historical_prices'])
 async def historical_prices_command(message):
     await start_historical_prices(message)
@@ -60,6 +83,21 @@ async def sma_command(message):
     await start_sma_analysis(message)
 
 
+@bot.message_handler(commands=['SMA_crosses'])
+async def sma_crosses_command(message):
+    await start_sma_crosses(message)
+
+
+@bot.message_handler(commands=['Screener'])
+async def screener_command(message):
+    # /Screener mag7 o /Screener AAPL MSFT NVDA corre directo; sin argumentos pregunta la lista
+    arguments = message.text.split(maxsplit=1)
+    if len(arguments) > 1:
+        await run_screener(message, arguments[1])
+    else:
+        await start_screener(message)
+
+
 # ============================================
 # MANEJO DE BOTONES DEL MENÚ PRINCIPAL
 # ============================================
@@ -75,6 +113,16 @@ async def sma_button(message):
     await start_sma_analysis(message)
 
 
+@bot.message_handler(func=lambda message: message.text == "🔀 SMA Crosses")
+async def sma_crosses_button(message):
+    await start_sma_crosses(message)
+
+
+@bot.message_handler(func=lambda message: message.text == "🧮 Screener")
+async def screener_button(message):
+    await start_screener(message)
+
+
 @bot.message_handler(func=lambda message: message.text == "📋 Full Data")
 async def full_data_button(message):
     await start_full_data(message)
@@ -200,36 +248,64 @@ async def process_chart_type(message):
         multiplier = data['multiplier']
         period = data['period']
     
-    await bot.send_message(
-        message.chat.id,
-        utils.SUCCESS_GENERATING_CHART,
-        reply_markup=keyboard.main_menu()
-    )
+    if estimated_bars(multiplier, period, start_date, end_date) > MAX_BARS:
+        await bot.send_message(message.chat.id, utils.ERROR_RANGE_TOO_LARGE.format(max_bars=MAX_BARS))
+        await bot.delete_state(message.from_user.id, message.chat.id)
+        return
+    
+    # Si el usuario ya tiene un trabajo en curso o la cola está llena se avisa al momento;
+    # el estado se conserva para que pueda reintentar
+    if not jobs.admit(message.from_user.id):
+        await bot.send_message(message.chat.id, utils.ERROR_BUSY)
+        return
     
     try:
-        loop = asyncio.get_event_loop()
-        chart_path = await loop.run_in_executor(
-            None,
-            get_historical_prices_chart,
-            ticker, multiplier, period, start_date, end_date, chart_type
+        await bot.send_message(
+            message.chat.id,
+            utils.SUCCESS_GENERATING_CHART,
+            reply_markup=keyboard.main_menu()
         )
         
-        if chart_path and os.path.exists(chart_path):
-            with open(chart_path, 'rb') as photo:
-                await bot.send_photo(
+        for attempt in range(2):
+            async with jobs.slot():
+                with request_context(INTERACTIVE, message.from_user.id):
+                    chart, chart_key, sampling = await get_historical_prices_chart(
+                        ticker, multiplier, period, start_date, end_date, chart_type
+                    )
+            
+            if not chart:
+                break
+            
+            caption = f"📈 {ticker} - {start_date} to {end_date}"
+            if sampling:
+                note = utils.NOTE_DOWNSAMPLED_LINE if chart_type == 'line' else utils.NOTE_DOWNSAMPLED_CANDLES
+                caption += "\n" + note.format(bars=sampling[0], plotted=sampling[1])
+            
+            try:
+                sent = await bot.send_photo(
                     message.chat.id,
-                    photo,
-                    caption=f"📈 {ticker} - {start_date} to {end_date}"
+                    chart,
+                    caption=caption
                 )
+            except ApiTelegramException:
+                # Un file_id que Telegram ya no reconoce se descarta y el gráfico se vuelve a subir
+                if attempt or not isinstance(chart, str):
+                    raise
+                forget_chart(chart_key)
+                continue
             
-            os.remove(chart_path)
-            
+            remember_chart(chart_key, sent.photo[-1].file_id)
+            break
+        
+        if chart:
             await bot.send_message(message.chat.id, utils.SUCCESS_CHART_GENERATED)
         else:
             await bot.send_message(message.chat.id, utils.ERROR_NO_DATA)
     
     except Exception as e:
         await bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
+    finally:
+        jobs.release(message.from_user.id)
     
     await bot.delete_state(message.from_user.id, message.chat.id)
 
@@ -263,15 +339,122 @@ async def process_ticker_sma(message):
         return
     
     print(f"✅ DEBUG: Valid ticker: {ticker}")
+    if not jobs.admit(message.from_user.id):
+        await bot.send_message(message.chat.id, utils.ERROR_BUSY)
+        return
+    
+    try:
+        await bot.send_message(
+            message.chat.id,
+            utils.SUCCESS_CALCULATING_SMA,
+            reply_markup=keyboard.main_menu()
+        )
+        
+        async with jobs.slot():
+            with request_context(INTERACTIVE, message.from_user.id):
+                result = await get_sma_analysis(ticker)
+        
+        await bot.send_message(
+            message.chat.id,
+            result,
+            parse_mode='Markdown'
+        )
+        
+    except Exception as e:
+        await bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
+    finally:
+        jobs.release(message.from_user.id)
+    
+    await bot.delete_state(message.from_user.id, message.chat.id)
+
+
+# ============================================
+# FLUJO DE CRUCES SMA
+# ============================================
+
+async def start_sma_crosses(message):
+    await bot.set_state(message.from_user.id, SMACrossStates.ticker, message.chat.id)
     await bot.send_message(
         message.chat.id,
-        utils.SUCCESS_CALCULATING_SMA,
-        reply_markup=keyboard.main_menu()
+        utils.PROMPT_TICKER,
+        reply_markup=keyboard.cancel_keyboard()
+    )
+
+
+async def process_ticker_sma_crosses(message):
+    ticker = message.text.strip()
+    
+    if not utils.validate_ticker(ticker):
+        await bot.send_message(message.chat.id, utils.ERROR_INVALID_TICKER)
+        return
+    
+    if not jobs.admit(message.from_user.id):
+        await bot.send_message(message.chat.id, utils.ERROR_BUSY)
+        return
+    
+    try:
+        await bot.send_message(
+            message.chat.id,
+            utils.SUCCESS_SCANNING_CROSSES,
+            reply_markup=keyboard.main_menu()
+        )
+        
+        async with jobs.slot():
+            with request_context(INTERACTIVE, message.from_user.id):
+                result = await get_sma_crossovers(ticker)
+        
+        await bot.send_message(
+            message.chat.id,
+            result,
+            parse_mode='Markdown'
+        )
+        
+    except Exception as e:
+        await bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
+    finally:
+        jobs.release(message.from_user.id)
+    
+    await bot.delete_state(message.from_user.id, message.chat.id)
+
+
+# ============================================
+# FLUJO DE SCREENER
+# ============================================
+
+async def start_screener(message):
+    await bot.set_state(message.from_user.id, ScreenerStates.tickers, message.chat.id)
+    await bot.send_message(
+        message.chat.id,
+        utils.PROMPT_WATCHLIST,
+        reply_markup=keyboard.cancel_keyboard()
     )
+
+
+async def process_tickers_screener(message):
+    await run_screener(message, message.text)
+
+
+async def run_screener(message, text):
+    tickers = resolve_watchlist(text)
+    
+    if not tickers or not all(utils.validate_ticker(ticker) for ticker in tickers):
+        await bot.send_message(message.chat.id, utils.ERROR_INVALID_WATCHLIST)
+        return
+    
+    if not jobs.admit(message.from_user.id):
+        await bot.send_message(message.chat.id, utils.ERROR_BUSY)
+        return
     
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, get_sma_analysis, ticker)
+        await bot.send_message(
+            message.chat.id,
+            utils.SUCCESS_SCREENING.format(count=len(tickers)),
+            reply_markup=keyboard.main_menu()
+        )
+        
+        async with jobs.slot():
+            with request_context(INTERACTIVE, message.from_user.id):
+                result, table = await get_screener(tickers)
         
         await bot.send_message(
             message.chat.id,
@@ -279,8 +462,16 @@ async def process_ticker_sma(message):
             parse_mode='Markdown'
         )
         
+        # La tabla completa va como CSV cuando no entra en el mensaje
+        if table is not None and len(table) > TOP_ROWS:
+            document = io.BytesIO(table.to_csv(index_label='rank', float_format='%.4f').encode())
+            document.name = 'screener.csv'
+            await bot.send_document(message.chat.id, document)
+        
     except Exception as e:
         await bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
+    finally:
+        jobs.release(message.from_user.id)
     
     await bot.delete_state(message.from_user.id, message.chat.id)
 
@@ -305,15 +496,20 @@ async def process_ticker_full_data(message):
         await bot.send_message(message.chat.id, utils.ERROR_INVALID_TICKER)
         return
     
-    await bot.send_message(
-        message.chat.id,
-        utils.STATUS_FETCHING_DATA,
-        reply_markup=keyboard.main_menu()
-    )
+    if not jobs.admit(message.from_user.id):
+        await bot.send_message(message.chat.id, utils.ERROR_BUSY)
+        return
     
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, get_full_data, ticker)
+        await bot.send_message(
+            message.chat.id,
+            utils.STATUS_FETCHING_DATA,
+            reply_markup=keyboard.main_menu()
+        )
+        
+        async with jobs.slot():
+            with request_context(INTERACTIVE, message.from_user.id):
+                result = await get_full_data(ticker)
         
         await bot.send_message(
             message.chat.id,
@@ -323,6 +519,8 @@ async def process_ticker_full_data(message):
         
     except Exception as e:
         await bot.send_message(message.chat.id, f"❌ Error: {str(e)}")
+    finally:
+        jobs.release(message.from_user.id)
     
     await bot.delete_state(message.from_user.id, message.chat.id)
 
@@ -339,6 +537,9 @@ async def handle_text_messages(message):
         print(f"🔴 DEBUG: Processing SMA ticker")
         await process_ticker_sma(message)
         return
+    elif current_state == "SMACrossStates:ticker":
+        await process_ticker_sma_crosses(message)
+        return
     elif current_state == "HistoricalPricesStates:ticker":
         await process_ticker_historical(message)
         return
@@ -360,8 +561,11 @@ async def handle_text_messages(message):
     elif current_state == "FullDataStates:ticker":
         await process_ticker_full_data(message)
         return
+    elif current_state == "ScreenerStates:tickers":
+        await process_tickers_screener(message)
+        return
     else:
-        if message.text not in ["📈 Historical Prices", "📊 SMA Analysis", "📋 Full Data", "ℹ️ Guide", "🔙 Back to Menu", "❌ Cancel"]:
+        if message.text not in ["📈 Historical Prices", "📊 SMA Analysis", "🔀 SMA Crosses", "🧮 Screener", "📋 Full Data", "ℹ️ Guide", "🔙 Back to Menu", "❌ Cancel"]:
             await bot.send_message(
                 message.chat.id,
                 "❓ Comando no reconocido. Usa /Guide para ver las opciones disponibles.",
@@ -375,12 +579,17 @@ async def handle_text_messages(message):
 
 async def main():
     print("🤖 Bot de Telegram iniciado...")
+    chart_renderer.start()
+    metrics_task = asyncio.create_task(metrics.log_periodically())
     print("✅ Esperando mensajes...")
     
     try:
         await bot.infinity_polling(skip_pending=True)
     except Exception as e:
         print(f"❌ Error: {e}")
+    finally:
+        metrics_task.cancel()
+        await close_resources()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+import numpy as np
+import pytz
+import config
+
+
+EASTERN = pytz.timezone('US/Eastern')
+
+REGULAR_CLOSE = time(16, 0)
+EARLY_CLOSE = time(13, 0)
+# Cuatro horas de after-hours después del cierre
+EXTENDED_HOURS = timedelta(hours=4)
+# Margen después del after-hours antes de dar la barra por definitiva (planes con datos diferidos)
+FINAL_GRACE = timedelta(minutes=getattr(config, 'session_final_grace_minutes', 60))
+
+# Cierres extraordinarios de la NYSE (huracanes, funerales de Estado)
+SPECIAL_CLOSURES = {
+    date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14),
+    date(2004, 6, 11), date(2007, 1, 2), date(2012, 10, 29), date(2012, 10, 30),
+    date(2018, 12, 5), date(2025, 1, 9),
+}
+
+CALENDAR_FIRST_YEAR = 2000
+
+
+def _easter(year):
+    # Algoritmo de Meeus/Jones/Butcher para el domingo de Pascua
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _nth_weekday(year, month, weekday, n):
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _last_weekday(year, month, weekday):
+    last = date(year, month + 1, 1) - timedelta(days=1) if month < 12 else date(year, 12, 31)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day):
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=None)
+def holidays(year):
+    days = {
+        _nth_weekday(year, 1, 0, 3),
+        _nth_weekday(year, 2, 0, 3),
+        _easter(year) - timedelta(days=2),
+        _last_weekday(year, 5, 0),
+        _observed(date(year, 7, 4)),
+        _nth_weekday(year, 9, 0, 1),
+        _nth_weekday(year, 11, 3, 4),
+        _observed(date(year, 12, 25)),
+    }
+
+    # Año Nuevo en sábado no se compensa el viernes anterior
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        days.add(_observed(new_year))
+
+    if year >= 2022:
+        days.add(_observed(date(year, 6, 19)))
+
+    days.update(day for day in SPECIAL_CLOSURES if day.year == year)
+    return frozenset(days)
+
+
+@lru_cache(maxsize=None)
+def early_closes(year):
+    days = {
+        date(year, 7, 3),
+        _nth_weekday(year, 11, 3, 4) + timedelta(days=1),
+        date(year, 12, 24),
+    }
+    return frozenset(day for day in days if day.weekday() < 5 and day not in holidays(year))
+
+
+@lru_cache(maxsize=4)
+def _busday_calendar(last_year):
+    all_holidays = [day for year in range(CALENDAR_FIRST_YEAR, last_year + 1) for day in holidays(year)]
+    return np.busdaycalendar(weekmask='1111100', holidays=sorted(all_holidays))
+
+
+def _calendar_for(*days):
+    return _busday_calendar(max(max(day.year for day in days), date.today().year) + 1)
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def is_trading_day(day):
+    day = _as_date(day)
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def session_close(day):
+    day = _as_date(day)
+    if not is_trading_day(day):
+        return None
+    close = EARLY_CLOSE if day in early_closes(day.year) else REGULAR_CLOSE
+    return EASTERN.localize(datetime.combine(day, close))
+
+
+def session_final(day):
+    # Momento a partir del cual la barra diaria (con after-hours) ya no cambia
+    close = session_close(day)
+    return close + EXTENDED_HOURS + FINAL_GRACE if close else None
+
+
+def trading_days(from_date, to_date):
+    count = count_sessions(from_date, to_date)
+    if count == 0:
+        return []
+    first = next_session(from_date)
+    sessions = np.busday_offset(first, np.arange(count), busdaycal=_calendar_for(first))
+    return [day.astype(object) for day in sessions]
+
+
+def count_sessions(from_date, to_date):
+    from_date, to_date = _as_date(from_date), _as_date(to_date)
+    if from_date > to_date:
+        return 0
+    return int(np.busday_count(from_date, to_date + timedelta(days=1), busdaycal=_calendar_for(from_date, to_date)))
+
+
+def previous_session(day, inclusive=True):
+    day = _as_date(day)
+    if not inclusive:
+        day -= timedelta(days=1)
+    return np.busday_offset(day, 0, roll='backward', busdaycal=_calendar_for(day)).astype(object)
+
+
+def next_session(day, inclusive=True):
+    day = _as_date(day)
+    if not inclusive:
+        day += timedelta(days=1)
+    return np.busday_offset(day, 0, roll='forward', busdaycal=_calendar_for(day)).astype(object)
+
+
+def sessions_back(sessions, end):
+    # Fecha inicial para que [inicio, end] contenga exactamente 'sessions' sesiones
+    end = previous_session(end)
+    return np.busday_offset(end, -(sessions - 1), roll='backward', busdaycal=_calendar_for(end)).astype(object)
+
+
+def last_final_session(now=None):
+    # Última sesión cuya barra diaria ya está cerrada
+    now = now or datetime.now(EASTERN)
+    today = now.date()
+    final = session_final(today)
+    if final and now >= final:
+        return today
+    return previous_session(today, inclusive=False)
+
+
+def trim_to_sessions(from_date, to_date):
+    # Recorta un rango a su primera y última sesión; None si no contiene ninguna
+    first = next_session(from_date)
+    last = previous_session(to_date)
+    if first > last:
+        return None
+    return first.isoformat(), last.isoformat()
@@ -0,0 +1,117 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+import config
+
+
+MAX_BYTES = getattr(config, 'memory_cache_max_bytes', 256 * 1024 * 1024)
+MAX_ENTRIES = getattr(config, 'memory_cache_max_entries', 2048)
+TTL_SECONDS = getattr(config, 'memory_cache_ttl_seconds', 300)
+
+CHART_CACHE_MAX_ENTRIES = getattr(config, 'chart_cache_max_entries', 4096)
+CHART_CACHE_TTL_SECONDS = getattr(config, 'chart_cache_ttl_seconds', 24 * 60 * 60)
+
+
+def size_of(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class MemoryCache:
+    # LRU en memoria delante del caché de Postgres, acotado por entradas, bytes y TTL.
+    # Los valores se comparten entre llamadas: quien los reciba no debe modificarlos.
+
+    def __init__(self, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        if value is None:
+            return
+
+        size = size_of(value)
+        if size > self.max_bytes:
+            return
+
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, time.monotonic() + ttl_seconds)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_ticker(self, ticker):
+        # Claves con forma (tipo, ticker, ...): se descartan todas las del ticker
+        with self._lock:
+            for key in [key for key in self._entries if isinstance(key, tuple) and len(key) > 1 and key[1] == ticker]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+
+cache = MemoryCache()
+
+# file_id de Telegram de los gráficos ya enviados; la clave incluye el hash de las barras
+chart_file_ids = MemoryCache(max_entries=CHART_CACHE_MAX_ENTRIES, ttl_seconds=CHART_CACHE_TTL_SECONDS)
@@ -0,0 +1,57 @@
+import asyncio
+from admission import jobs
+from memory_cache import cache
+from rate_limiter import limiter
+from single_flight import flights
+from write_behind import writer
+import config
+
+
+# Cada cuántos segundos se escriben las métricas en el log (0 las desactiva)
+LOG_INTERVAL_SECONDS = getattr(config, 'metrics_log_interval_seconds', 300)
+# Usuarios de Telegram que pueden pedir /Stats
+ADMIN_USER_IDS = getattr(config, 'admin_user_ids', [])
+
+
+def snapshot():
+    return {
+        'write_behind': writer.stats(),
+        'memory_cache': cache.stats(),
+        'single_flight': flights.stats(),
+        'rate_limiter': limiter.stats(),
+        'jobs': jobs.stats()
+    }
+
+
+def format_metrics():
+    stats = snapshot()
+    write_behind = stats['write_behind']
+    memory = stats['memory_cache']
+    flight = stats['single_flight']
+    rate = stats['rate_limiter']
+    job = stats['jobs']
+
+    return "\n".join([
+        f"💾 Escritura diferida: cola {write_behind['depth']} ({write_behind['rows']:,} barras), {write_behind['flushes']} lotes, "
+        f"{write_behind['flushed_rows']:,} barras, último {write_behind['last_flush_ms']} ms, "
+        f"promedio {write_behind['avg_flush_ms']} ms, {write_behind['retries']} reintentos, {write_behind['dropped']} descartados",
+        f"⚡ Memoria: {memory['entries']} entradas, {memory['bytes'] / 1024 / 1024:.1f} MB, "
+        f"aciertos {memory['hit_rate']:.0%} ({memory['hits']}/{memory['hits'] + memory['misses']}), "
+        f"{memory['evictions']} desalojos, {memory['expirations']} vencidas",
+        f"🔗 Consultas unificadas: {flight['coalesced']} de {flight['calls']} llamadas, {flight['in_flight']} en curso",
+        f"🚦 Polygon: {rate['granted']} concedidas, {rate['waited']} con espera, {rate['tokens']} tokens, "
+        f"pendientes {rate['pending']}",
+        f"⏳ Trabajos: {job['running']} en curso, {job['queued']} en cola, {job['admitted']} admitidos, {job['rejected']} rechazados"
+    ])
+
+
+async def log_periodically():
+    if LOG_INTERVAL_SECONDS <= 0:
+        return
+    while True:
+        await asyncio.sleep(LOG_INTERVAL_SECONDS)
+        print("📊 Métricas\n" + format_metrics())
+
+
+def is_admin(user_id):
+    return user_id in ADMIN_USER_IDS
@@ -0,0 +1,62 @@
+import asyncio
+import aiohttp
+from rate_limiter import limiter, REQUESTS_PER_MINUTE
+import config
+from config import api_key
+
+
+BASE_URL = 'https://api.polygon.io'
+
+CONNECT_TIMEOUT = getattr(config, 'polygon_connect_timeout', 3.05)
+READ_TIMEOUT = getattr(config, 'polygon_read_timeout', 20)
+POOL_SIZE = getattr(config, 'polygon_pool_size', 16)
+MAX_ATTEMPTS = 3
+
+# Errores de red, HTTP y timeout que deben capturar quienes llaman a get_json
+REQUEST_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+_session = None
+_session_loop = None
+
+
+def get_session():
+    # Una sola sesión por event loop con conexiones keep-alive reutilizadas
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        _session_loop = loop
+    return _session
+
+
+async def get_json(path, params=None):
+    params = {key: str(value) for key, value in (params or {}).items()}
+    params['apiKey'] = api_key
+    url = path if path.startswith('http') else f"{BASE_URL}{path}"
+
+    for attempt in range(MAX_ATTEMPTS):
+        # Toda llamada pasa por el limitador global (prioridad y usuario vienen del contexto)
+        await limiter.acquire()
+        async with get_session().get(url, params=params) as response:
+            if response.status == 429 and attempt < MAX_ATTEMPTS - 1:
+                try:
+                    retry_after = float(response.headers.get('Retry-After', 60 / REQUESTS_PER_MINUTE))
+                except ValueError:
+                    retry_after = 60 / REQUESTS_PER_MINUTE
+                print(f"⏳ Límite de Polygon alcanzado, reintentando en {retry_after:.0f}s")
+                limiter.pause(retry_after)
+                continue
+
+            response.raise_for_status()
+            return await response.json()
+
+
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -1,12 +1,21 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
+from datetime import datetime
+from sqlalchemy import create_engine, text, func, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+import config
 from config import postgres_user, postgres_password, postgres_host, postgres_port, postgres_db
 
+# Particionado por año de la tabla de barras (opcional, ver config.example.py)
+PARTITION_BARS = getattr(config, 'postgres_partition_bars', False)
+# Años por delante del actual para los que se crean particiones (la migración se corre de nuevo cada año)
+PARTITION_YEARS_AHEAD = getattr(config, 'postgres_partition_years_ahead', 2)
+
 Base = declarative_base()
 
 
 class RequestParams(Base):
+    # Cada fila registra un rango de fechas ya consultado a Polygon (cobertura del caché)
     __tablename__ = 'request_params'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -15,9 +24,16 @@ class RequestParams(Base):
     timespan = Column(String(10), nullable=False)
     from_date = Column(String(10), nullable=False)
     to_date = Column(String(10), nullable=False)
+    fetched_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # Los rangos que incluyen la sesión en curso solo valen durante open_bars_ttl_seconds
+    is_final = Column(Boolean, nullable=False, server_default='true')
     
     results = relationship("HistPricesResults", back_populates="request")
     
+    __table_args__ = (
+        Index('ix_request_params_lookup', 'ticker', 'multiplier', 'timespan', 'from_date', 'to_date'),
+    )
+    
     def __repr__(self):
         return f"<RequestParams(ticker={self.ticker}, from={self.from_date}, to={self.to_date})>"
 
@@ -37,14 +53,68 @@ class HistPricesResults(Base):
     
     request = relationship("RequestParams", back_populates="results")
     
+    __table_args__ = (
+        Index('ix_hist_prices_results_request', 'request_id', 'timestamp'),
+    )
+    
     def __repr__(self):
         return f"<HistPricesResults(timestamp={self.timestamp}, close={self.close})>"
 
 
+class Bars(Base):
+
+    __tablename__ = 'bars'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ticker = Column(String(10), nullable=False)
+    multiplier = Column(Integer, nullable=False)
+    timespan = Column(String(10), nullable=False)
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+    volume = Column(Float, nullable=False)
+    open = Column(Float, nullable=False)
+    close = Column(Float, nullable=False)
+    high = Column(Float, nullable=False)
+    low = Column(Float, nullable=False)
+    fetched_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    is_final = Column(Boolean, nullable=False, server_default='true')
+    
+    __table_args__ = (
+        UniqueConstraint('ticker', 'multiplier', 'timespan', 'timestamp', name='uq_bars_key'),
+        Index('ix_bars_timestamp_brin', 'timestamp', postgresql_using='brin'),
+    )
+    
+    def __repr__(self):
+        return f"<Bars(ticker={self.ticker}, timestamp={self.timestamp}, close={self.close})>"
+
+
+class SmaState(Base):
+    # Ventana móvil persistida por ticker y largo: se actualiza con cada barra diaria nueva
+    __tablename__ = 'sma_state'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ticker = Column(String(10), nullable=False)
+    window = Column(Integer, nullable=False)
+    running_sum = Column(Float, nullable=False)
+    running_sum_sq = Column(Float, nullable=False)
+    # Últimos 'window' cierres, del más antiguo al más reciente
+    closes = Column(ARRAY(Float), nullable=False)
+    ema = Column(Float, nullable=True)
+    pushes = Column(Integer, nullable=False, server_default='0')
+    last_date = Column(String(10), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    
+    __table_args__ = (
+        UniqueConstraint('ticker', 'window', name='uq_sma_state_key'),
+    )
+    
+    def __repr__(self):
+        return f"<SmaState(ticker={self.ticker}, window={self.window}, last_date={self.last_date})>"
+
+
 def create_tables():
     try:
         engine = create_engine(
-            f'postgresql://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
+            f'postgresql+psycopg://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
         )
         
         Base.metadata.create_all(engine)
@@ -52,12 +122,155 @@ def create_tables():
         print("✅ Tablas creadas exitosamente:")
         print("   - request_params")
         print("   - hist_prices_results")
+        print("   - bars")
+        print("   - sma_state")
         
     except Exception as error:
         print(f"❌ Error al crear las tablas: {error}")
 
 
+def create_year_partition(connection, year):
+    exists = connection.execute(text("SELECT to_regclass(:name)"), {'name': f'bars_{year}'}).scalar()
+    if exists:
+        return
+    
+    # Postgres no deja crear una partición si bars_default ya tiene barras de ese año:
+    # se sacan a una tabla temporal, se crea la partición y se vuelven a insertar
+    bounds = {'start': f'{year}-01-01', 'end': f'{year + 1}-01-01'}
+    connection.execute(text("CREATE TEMP TABLE bars_moving (LIKE bars) ON COMMIT DROP"))
+    moved = connection.execute(text("""
+        WITH moved AS (
+            DELETE FROM bars_default
+            WHERE timestamp >= CAST(:start AS timestamptz) AND timestamp < CAST(:end AS timestamptz)
+            RETURNING *
+        )
+        INSERT INTO bars_moving SELECT * FROM moved
+    """), bounds).rowcount
+    connection.execute(text(
+        f"CREATE TABLE bars_{year} PARTITION OF bars FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+    ))
+    connection.execute(text("INSERT INTO bars SELECT * FROM bars_moving"))
+    connection.execute(text("DROP TABLE bars_moving"))
+    if moved:
+        print(f"✅ Partición bars_{year} creada ({moved} barras movidas desde bars_default)")
+
+
+def partition_bars(connection):
+    relkind = connection.execute(text("SELECT relkind FROM pg_class WHERE relname = 'bars'")).scalar()
+    current_year = datetime.now().year
+    
+    if relkind != 'p':
+        first_year = connection.execute(text(
+            "SELECT COALESCE(EXTRACT(YEAR FROM MIN(timestamp))::int, :year) FROM bars"
+        ), {'year': current_year}).scalar()
+        
+        # Se reemplaza la tabla por una particionada por rango de timestamp y se copian las barras
+        connection.execute(text("ALTER TABLE bars RENAME TO bars_unpartitioned"))
+        connection.execute(text("ALTER TABLE bars_unpartitioned RENAME CONSTRAINT uq_bars_key TO uq_bars_unpartitioned_key"))
+        connection.execute(text("ALTER TABLE bars_unpartitioned RENAME CONSTRAINT bars_pkey TO bars_unpartitioned_pkey"))
+        connection.execute(text("ALTER SEQUENCE bars_id_seq RENAME TO bars_unpartitioned_id_seq"))
+        connection.execute(text("DROP INDEX IF EXISTS ix_bars_timestamp_brin"))
+        connection.execute(text("""
+            CREATE TABLE bars (
+                id SERIAL,
+                ticker VARCHAR(10) NOT NULL,
+                multiplier INTEGER NOT NULL,
+                timespan VARCHAR(10) NOT NULL,
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+                volume FLOAT NOT NULL,
+                open FLOAT NOT NULL,
+                close FLOAT NOT NULL,
+                high FLOAT NOT NULL,
+                low FLOAT NOT NULL,
+                fetched_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                is_final BOOLEAN NOT NULL DEFAULT true,
+                CONSTRAINT bars_pkey PRIMARY KEY (id, timestamp),
+                CONSTRAINT uq_bars_key UNIQUE (ticker, multiplier, timespan, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        """))
+        connection.execute(text("CREATE TABLE bars_default PARTITION OF bars DEFAULT"))
+        for year in range(first_year, current_year + PARTITION_YEARS_AHEAD + 1):
+            create_year_partition(connection, year)
+        connection.execute(text("""
+            INSERT INTO bars (id, ticker, multiplier, timespan, timestamp, volume, open, close, high, low, fetched_at, is_final)
+            SELECT id, ticker, multiplier, timespan, timestamp, volume, open, close, high, low, fetched_at, is_final
+            FROM bars_unpartitioned
+        """))
+        connection.execute(text("SELECT setval('bars_id_seq', COALESCE((SELECT MAX(id) FROM bars), 0) + 1, false)"))
+        connection.execute(text("DROP TABLE bars_unpartitioned"))
+        print(f"✅ Tabla bars particionada por año ({first_year} a {current_year + PARTITION_YEARS_AHEAD})")
+    else:
+        # Crea las particiones que falten, incluidas las de años que ya cayeron en bars_default
+        years = connection.execute(text(
+            "SELECT DISTINCT EXTRACT(YEAR FROM timestamp)::int FROM bars_default"
+        )).scalars().all()
+        for year in sorted(set(years) | set(range(current_year, current_year + PARTITION_YEARS_AHEAD + 1))):
+            create_year_partition(connection, year)
+        print("ℹ️  La tabla bars ya está particionada.")
+
+
+def migrate_tables():
+    try:
+        engine = create_engine(
+            f'postgresql+psycopg://{postgres_user}:{postgres_password}@{postgres_host}:{postgres_port}/{postgres_db}'
+        )
+        
+        with engine.begin() as connection:
+            added = connection.execute(text(
+                "SELECT 1 FROM information_schema.columns WHERE table_name = 'request_params' AND column_name = 'is_final'"
+            )).first() is None
+            for table in ('request_params', 'bars'):
+                connection.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()"
+                ))
+                connection.execute(text(
+                    f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS is_final BOOLEAN NOT NULL DEFAULT true"
+                ))
+            if added:
+                # Los rangos guardados antes no tienen hora de descarga confiable: se marcan
+                # como abiertos y vencidos para que se vuelvan a pedir una sola vez
+                connection.execute(text(
+                    "UPDATE request_params SET is_final = false, fetched_at = to_timestamp(0)"
+                ))
+                print("✅ Columnas fetched_at / is_final agregadas")
+            
+            exists = connection.execute(text(
+                "SELECT 1 FROM pg_constraint WHERE conname = 'uq_bars_key'"
+            )).first()
+            
+            if not exists:
+                # Deja una sola barra por clave (la más reciente) antes de crear la restricción
+                deleted = connection.execute(text("""
+                    DELETE FROM bars b
+                    USING bars newer
+                    WHERE b.ticker = newer.ticker
+                      AND b.multiplier = newer.multiplier
+                      AND b.timespan = newer.timespan
+                      AND b.timestamp = newer.timestamp
+                      AND b.id < newer.id
+                """)).rowcount
+                connection.execute(text("DROP INDEX IF EXISTS ix_bars_lookup"))
+                connection.execute(text(
+                    "ALTER TABLE bars ADD CONSTRAINT uq_bars_key UNIQUE (ticker, multiplier, timespan, timestamp)"
+                ))
+                print(f"✅ Restricción uq_bars_key creada ({deleted} barras duplicadas eliminadas)")
+            else:
+                print("ℹ️  La restricción uq_bars_key ya existe.")
+            
+            if PARTITION_BARS:
+                partition_bars(connection)
+            
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+            print("✅ Índices verificados")
+        
+    except Exception as error:
+        print(f"❌ Error al migrar las tablas: {error}")
+
+
 if __name__ == "__main__":
     print("🔧 Iniciando creación de tablas...")
     create_tables()
+    migrate_tables()
     print("✅ Proceso completado!")
@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import config
+
+
+REQUESTS_PER_MINUTE = getattr(config, 'polygon_requests_per_minute', 5)
+BURST = getattr(config, 'polygon_burst', 5)
+
+# Clases de prioridad: menor número se atiende primero
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_priority = contextvars.ContextVar('polygon_priority', default=BACKGROUND)
+_user_id = contextvars.ContextVar('polygon_user_id', default=None)
+
+
+@contextmanager
+def request_context(priority, user_id=None):
+    # Las llamadas a Polygon hechas dentro del bloque (y de sus tareas) usan esta prioridad y usuario
+    priority_token = _priority.set(priority)
+    user_token = _user_id.set(user_id)
+    try:
+        yield
+    finally:
+        _priority.reset(priority_token)
+        _user_id.reset(user_token)
+
+
+class RateLimiter:
+    # Token bucket global con colas por prioridad y turnos rotativos entre usuarios dentro de cada prioridad
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, burst=BURST):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.tokens = burst
+        self.granted = 0
+        self.waited = 0
+        self._updated = None
+        self._paused_until = 0
+        self._queues = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+        self._loop = None
+        self._dispatcher = None
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._reset(loop)
+
+        self._refill()
+        if self.tokens >= 1 and not self.pending() and loop.time() >= self._paused_until:
+            self.tokens -= 1
+            self.granted += 1
+            return
+
+        future = loop.create_future()
+        self._queues[_priority.get()].setdefault(_user_id.get(), deque()).append(future)
+        self.waited += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+        await future
+
+    def pause(self, seconds):
+        # Tras un 429 se vacía el bucket y nadie sale hasta que pase el tiempo indicado
+        if self._loop is None:
+            return
+        self.tokens = 0
+        self._paused_until = max(self._paused_until, self._loop.time() + seconds)
+
+    def pending(self):
+        return sum(len(waiters) for queue in self._queues.values() for waiters in queue.values())
+
+    def stats(self):
+        return {
+            'tokens': round(self.tokens, 2),
+            'granted': self.granted,
+            'waited': self.waited,
+            'pending': {priority: sum(len(w) for w in queue.values()) for priority, queue in self._queues.items()}
+        }
+
+    def _reset(self, loop):
+        self._loop = loop
+        self._dispatcher = None
+        self._updated = loop.time()
+        self._paused_until = 0
+        self._queues = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+
+    def _refill(self):
+        now = self._loop.time()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _next_waiter(self):
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            while queue:
+                user_id, waiters = next(iter(queue.items()))
+                future = waiters.popleft()
+                if waiters:
+                    queue.move_to_end(user_id)
+                else:
+                    del queue[user_id]
+                if not future.done():
+                    return future
+        return None
+
+    async def _dispatch(self):
+        while self.pending():
+            now = self._loop.time()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+
+            future = self._next_waiter()
+            if future is not None:
+                self.tokens -= 1
+                self.granted += 1
+                future.set_result(None)
+
+
+limiter = RateLimiter()
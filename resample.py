@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+
+RESAMPLED_TIMESPANS = ['week', 'month', 'quarter', 'year']
+
+# Domingo de referencia para numerar semanas (las semanas de Polygon van de domingo a sábado)
+WEEK_EPOCH = np.datetime64('1970-01-04', 'D')
+
+
+def period_index(dates, timespan):
+    # Número de periodo (semana, mes, trimestre o año) de cada fecha, como enteros
+    if timespan == 'week':
+        return (dates - WEEK_EPOCH).astype('int64') // 7
+    months = dates.astype('datetime64[M]').astype('int64')
+    if timespan == 'month':
+        return months
+    if timespan == 'quarter':
+        return months // 3
+    return months // 12
+
+
+def period_start(periods, timespan):
+    if timespan == 'week':
+        return WEEK_EPOCH + (periods * 7).astype('timedelta64[D]')
+    months = {'month': 1, 'quarter': 3, 'year': 12}[timespan]
+    return (periods * months).astype('datetime64[M]').astype('datetime64[D]')
+
+
+def resample_bars(df, multiplier, timespan, from_date=None):
+    if df.empty:
+        return df
+
+    df = df.sort_index()
+    dates = df.index.tz_convert('US/Eastern').tz_localize(None).to_numpy().astype('datetime64[D]')
+    periods = period_index(dates, timespan)
+
+    # Las ventanas de N periodos se anclan en el periodo de la fecha inicial pedida
+    anchor = period_index(np.array([from_date], dtype='datetime64[D]'), timespan)[0] if from_date else periods[0]
+    groups = anchor + (periods - anchor) // multiplier * multiplier
+
+    grouped = df.groupby(groups, sort=True)
+    bars = pd.DataFrame({
+        'volume': grouped['volume'].sum(),
+        'open': grouped['open'].first(),
+        'close': grouped['close'].last(),
+        'high': grouped['high'].max(),
+        'low': grouped['low'].min()
+    })
+
+    starts = period_start(bars.index.to_numpy(), timespan)
+    bars.index = pd.DatetimeIndex(starts, name='timestamp').tz_localize('US/Eastern')
+    return bars
@@ -0,0 +1,24 @@
+import asyncio
+import bar_store
+import chart_renderer
+import polygon_client
+from write_behind import writer
+
+
+async def close_resources():
+    await polygon_client.close()
+    # Primero se vacía la cola de escritura, después se cierran las conexiones a Postgres
+    await writer.close()
+    await bar_store.close()
+    await chart_renderer.close()
+
+
+def run(coroutine):
+    # Ejecuta una corrutina de la capa de datos desde código síncrono (scripts y __main__)
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await close_resources()
+
+    return asyncio.run(main())
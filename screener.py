@@ -0,0 +1,331 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import polygon_client
+import indicators
+from bar_store import GROUPED_TICKER, find_missing_ranges, read_daily_closes, save_grouped, write_batch
+from historical_prices import fetch_historical_prices, stream_from_polygon
+from sma import invalidate_prices
+from market_calendar import last_final_session, sessions_back, trading_days
+from rate_limiter import request_context, BACKGROUND
+from runtime import run
+import config
+
+
+# Sesiones por ticker: alcanzan para la SMA 200 y para ver el último cruce
+SCREENER_SESSIONS = getattr(config, 'screener_sessions', 250)
+MAX_TICKERS = getattr(config, 'screener_max_tickers', 600)
+# Sesiones faltantes que se cargan dentro de la consulta; con más se hace una carga en segundo plano
+INLINE_SESSIONS = getattr(config, 'screener_inline_sessions', 5)
+# Tickers sin historial guardado que se piden dentro de la consulta; con más se cargan en segundo plano
+INLINE_TICKERS = getattr(config, 'screener_inline_tickers', 10)
+# Filas de cada extremo del ranking que entran en el mensaje
+TOP_ROWS = 15
+# Listas con nombre que se pueden pedir al bot en lugar de escribir los tickers
+WATCHLISTS = getattr(config, 'screener_watchlists', {
+    'mag7': ['AAPL', 'MSFT', 'GOOGL', 'AMZN', 'NVDA', 'META', 'TSLA']
+})
+
+
+async def fetch_grouped_daily(day):
+    # Barras diarias de todos los tickers del mercado en una sola llamada
+    path = f"/v2/aggs/grouped/locale/us/market/stocks/{day}"
+
+    try:
+        data = await polygon_client.get_json(path, {'adjusted': 'true'})
+    except polygon_client.REQUEST_ERRORS as e:
+        print(f"❌ Error en la solicitud: {e}")
+        return None
+
+    if data.get('status') not in ('OK', 'DELAYED'):
+        print(f"⚠️ No se encontraron datos: {data.get('status')}")
+        return None
+
+    df = pd.DataFrame(data.get('results', []), columns=['T', 'v', 'o', 'c', 'h', 'l'])
+    df = df.rename(columns={'T': 'ticker', 'v': 'volume', 'o': 'open', 'c': 'close', 'h': 'high', 'l': 'low'})
+    return df[df['ticker'].str.len() <= 10]
+
+
+async def fetch_splits(from_date, to_date):
+    # Tickers con un split ejecutado en el rango (referencia de Polygon); None si la consulta falla
+    path = "/v3/reference/splits"
+    params = {'execution_date.gte': from_date, 'execution_date.lte': to_date, 'limit': 1000}
+    tickers = set()
+
+    while path:
+        try:
+            data = await polygon_client.get_json(path, params)
+        except polygon_client.REQUEST_ERRORS as e:
+            print(f"❌ Error en la solicitud: {e}")
+            return None
+
+        if data.get('status') not in ('OK', 'DELAYED'):
+            print(f"⚠️ No se pudieron consultar los splits: {data.get('status')}")
+            return None
+
+        tickers.update(split['ticker'] for split in data.get('results', []))
+        path = data.get('next_url')
+        params = None
+
+    return tickers
+
+
+async def restate_ticker(ticker, from_date, to_date):
+    # Descarta lo guardado del ticker y vuelve a escribir la ventana con los precios ya ajustados por el split
+    await invalidate_prices(ticker)
+
+    pages = []
+    async for page in stream_from_polygon(ticker, 1, 'day', from_date, to_date):
+        if page is None:
+            return False
+        pages.append(page)
+
+    bars = [(ticker, 1, 'day', page) for page in pages if not page.empty]
+    try:
+        await write_batch(bars, [(ticker, 1, 'day', from_date, to_date)])
+    except Exception as e:
+        print(f"Error al guardar en caché: {e}")
+        return False
+    return True
+
+
+async def restate_splits(missing, sessions):
+    # Las barras del mercado completo se guardan ajustadas al día en que se pidieron: si un ticker tuvo un split
+    # en las sesiones nuevas, sus sesiones ya guardadas quedaron con precios previos al split
+    splits = await fetch_splits(missing[0], missing[-1])
+    if splits is None:
+        return False
+    if not splits:
+        return True
+
+    # Solo importan los que ya tienen sesiones guardadas en la ventana
+    stored = await read_daily_closes(sorted(splits), sessions[0], sessions[-1])
+    if stored is None:
+        return False
+    affected = sorted(set(stored['ticker']))
+    if not affected:
+        return True
+
+    print(f"🔁 Screener: {len(affected)} tickers con split; se vuelven a pedir sus barras diarias")
+    restated = await asyncio.gather(*(restate_ticker(ticker, sessions[0], sessions[-1]) for ticker in affected))
+    return all(restated)
+
+
+async def update_grouped(missing, sessions):
+    # Sin la revisión de splits las sesiones nuevas no se guardan: se reintenta en la próxima consulta
+    if missing and len(missing) < len(sessions) and not await restate_splits(missing, sessions):
+        return False
+    return await load_grouped(missing)
+
+
+async def load_grouped_day(day):
+    # Una sesión sin barras todavía no está publicada: sin cobertura se vuelve a pedir
+    df = await fetch_grouped_daily(day)
+    return df is not None and not df.empty and await save_grouped(day, df)
+
+
+async def load_grouped(days):
+    # Cada sesión del mercado completo se guarda apenas llega (la cobertura es por día): si alguna falla,
+    # las demás quedan guardadas y un nuevo intento solo pide las que faltan
+    loaded = await asyncio.gather(*(load_grouped_day(day) for day in days))
+    failed = len(loaded) - sum(loaded)
+    if failed:
+        print(f"⚠️ Screener: {failed} de {len(days)} sesiones del mercado completo no se pudieron cargar")
+    return not failed
+
+
+async def backfill(description, coroutine):
+    # Cargas largas con prioridad baja: no le quitan cupo de Polygon a las consultas interactivas
+    with request_context(BACKGROUND):
+        await coroutine
+    print(f"✅ Screener: carga terminada ({description})")
+
+
+_backfill = {'task': None, 'description': None}
+
+
+def start_backfill(description, coroutine):
+    # Una sola carga en segundo plano a la vez; devuelve la que está en curso
+    if backfill_running():
+        coroutine.close()
+    else:
+        print(f"🕓 Screener: cargando {description} en segundo plano")
+        _backfill['task'] = asyncio.get_running_loop().create_task(backfill(description, coroutine))
+        _backfill['description'] = description
+    return _backfill['description']
+
+
+def backfill_running():
+    return _backfill['task'] is not None and not _backfill['task'].done()
+
+
+async def load_per_ticker(tickers, from_date, to_date):
+    # Pocos tickers: una consulta por ticker (o ninguna si ya están en caché), todas concurrentes
+    frames = await asyncio.gather(*(fetch_historical_prices(ticker, 1, 'day', from_date, to_date) for ticker in tickers))
+
+    closes = []
+    for ticker, df in zip(tickers, frames):
+        if df is None or df.empty:
+            continue
+        closes.append(pd.DataFrame({
+            'ticker': ticker,
+            'date': df.index.tz_localize(None).strftime('%Y-%m-%d'),
+            'close': df['close'].to_numpy(dtype='float64')
+        }))
+
+    if not closes:
+        return pd.DataFrame(columns=['ticker', 'date', 'close'])
+    return pd.concat(closes, ignore_index=True)
+
+
+def close_matrix(closes, tickers, sessions):
+    # Matriz tickers x sesiones; los huecos (suspensiones) toman el cierre anterior
+    matrix = closes.pivot_table(index='ticker', columns='date', values='close', aggfunc='last')
+    matrix = matrix.reindex(index=tickers, columns=sessions).to_numpy(dtype='float64')
+
+    positions = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[1]))
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    filled = np.take_along_axis(matrix, positions, axis=1)
+    started = np.maximum.accumulate(~np.isnan(matrix), axis=1)
+    return np.where(started, filled, np.nan)
+
+
+def rank(tickers, matrix):
+    series = indicators.compute(matrix, sma_windows=[50, 200])
+    sma_50 = series['sma'][50][:, -1]
+    sma_200 = series['sma'][200][:, -1]
+    price = matrix[:, -1]
+
+    # Sesiones desde el último cruce SMA 50 / SMA 200 de cada fila, sin recorrer día por día
+    signs = np.sign(series['sma'][50] - series['sma'][200])
+    crossed = (signs[:, 1:] != signs[:, :-1]) & (signs[:, 1:] != 0) & (signs[:, :-1] != 0)
+    crossed &= ~np.isnan(signs[:, 1:]) & ~np.isnan(signs[:, :-1])
+    since_cross = np.where(crossed.any(axis=1), crossed[:, ::-1].argmax(axis=1), -1)
+
+    table = pd.DataFrame({
+        'ticker': tickers,
+        'price': price,
+        'sma_50': sma_50,
+        'sma_200': sma_200,
+        'vs_sma50': (price - sma_50) / sma_50 * 100,
+        'vs_sma200': (price - sma_200) / sma_200 * 100,
+        'spread': (sma_50 - sma_200) / sma_200 * 100,
+        'since_cross': since_cross
+    })
+
+    table['trend'] = np.select(
+        [table['spread'] > 0, table['spread'] < 0, table['spread'].isna()],
+        ['ALCISTA', 'BAJISTA', 'SIN DATOS'],
+        default='CRUCE'
+    )
+
+    # Primero los que tienen SMA 200; ordenados por fuerza de la tendencia (spread SMA 50 / SMA 200)
+    table = table.sort_values('spread', ascending=False, na_position='last').reset_index(drop=True)
+    table.index += 1
+    return table
+
+
+async def screen(tickers):
+    # Devuelve (tabla, carga en segundo plano): la tabla es None si falta una carga larga o no hay datos
+    tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers))[:MAX_TICKERS]
+
+    to_date = last_final_session()
+    from_date = sessions_back(SCREENER_SESSIONS, to_date)
+    sessions = [day.isoformat() for day in trading_days(from_date, to_date)]
+
+    # Sesiones que todavía no están guardadas para todo el mercado
+    gaps = await find_missing_ranges(GROUPED_TICKER, 1, 'day', sessions[0], sessions[-1])
+    missing = [day.isoformat() for gap_from, gap_to in gaps for day in trading_days(gap_from, gap_to)]
+
+    # Se elige la opción con menos llamadas a Polygon: una por sesión faltante o una por ticker
+    if len(missing) <= len(tickers):
+        # Mientras se carga el mercado completo las sesiones faltantes se siguen pidiendo allí
+        if backfill_running() or len(missing) > INLINE_SESSIONS:
+            description = f"el historial diario del mercado completo ({len(missing)} sesiones)"
+            return None, start_backfill(description, update_grouped(missing, sessions))
+        print(f"📡 Screener: {len(missing)} sesiones del mercado completo para {len(tickers)} tickers")
+        if not await update_grouped(missing, sessions):
+            return None, None
+        # Los cierres de todo el universo salen del caché con una sola consulta
+        closes = await read_daily_closes(tickers, sessions[0], sessions[-1])
+    else:
+        # Los tickers sin el rango guardado cuestan una consulta cada uno
+        ticker_gaps = await asyncio.gather(*(
+            find_missing_ranges(ticker, 1, 'day', sessions[0], sessions[-1]) for ticker in tickers
+        ))
+        cold = [ticker for ticker, ticker_gap in zip(tickers, ticker_gaps) if ticker_gap]
+        if len(cold) > INLINE_TICKERS:
+            description = f"el historial diario de {len(cold)} tickers"
+            return None, start_backfill(description, load_per_ticker(cold, sessions[0], sessions[-1]))
+        print(f"📡 Screener: consultas por ticker para {len(cold)} de {len(tickers)} tickers")
+        closes = await load_per_ticker(tickers, sessions[0], sessions[-1])
+
+    if closes is None or closes.empty:
+        return None, None
+
+    return rank(tickers, close_matrix(closes, tickers, sessions)), None
+
+
+def resolve_watchlist(text):
+    # Nombre de una watchlist configurada o tickers separados por espacios / comas
+    name = text.strip().lower()
+    if name in WATCHLISTS:
+        return list(WATCHLISTS[name])
+    return [ticker for ticker in text.replace(',', ' ').split() if ticker]
+
+
+def format_screener_result(table, top=TOP_ROWS):
+    if table is None or table.empty:
+        return "❌ No se pudieron obtener datos para el screener."
+
+    ranked = table.dropna(subset=['sma_200'])
+    missing = len(table) - len(ranked)
+
+    def rows(part):
+        lines = [f"{'#':>3} {'Ticker':<6} {'Precio':>9} {'vs200':>7} {'Spread':>7} {'Cruce':>5}"]
+        for position, row in part.iterrows():
+            cross = f"{row['since_cross']}" if row['since_cross'] >= 0 else "-"
+            lines.append(
+                f"{position:>3} {row['ticker']:<6} {row['price']:>9.2f} {row['vs_sma200']:>+6.1f}% {row['spread']:>+6.1f}% {cross:>5}"
+            )
+        return "\n".join(lines)
+
+    bullish = int((ranked['trend'] == 'ALCISTA').sum())
+    bearish = int((ranked['trend'] == 'BAJISTA').sum())
+
+    message = f"""
+🧮 **SCREENER SMA 50 / SMA 200**
+
+🟢 Alcistas: {bullish}   🔴 Bajistas: {bearish}   ⚪ Sin datos suficientes: {missing}
+
+**Tendencia más fuerte:**
+```
+{rows(ranked.head(top))}
+```
+"""
+
+    if len(ranked) > top:
+        message += f"""
+**Tendencia más débil:**
+```
+{rows(ranked.tail(min(top, len(ranked) - top)))}
+```
+"""
+
+    message += """
+Spread = distancia de la SMA 50 a la SMA 200. Cruce = sesiones desde el último cruce.
+⚠️ **Nota:** Este análisis es solo informativo. No es asesoramiento financiero.
+"""
+    return message
+
+
+async def get_screener(tickers):
+    table, loading = await screen(tickers)
+    if loading:
+        return f"⏳ Cargando {loading} en segundo plano. Intenta de nuevo en unos minutos.", None
+    return format_screener_result(table), table
+
+
+if __name__ == "__main__":
+    message, _ = run(get_screener(resolve_watchlist('mag7')))
+    print(message)
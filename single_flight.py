@@ -0,0 +1,47 @@
+import asyncio
+import functools
+
+
+class SingleFlight:
+    # Las llamadas concurrentes con la misma clave esperan una única ejecución y comparten su resultado
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key, function, *args, **kwargs):
+        self.calls += 1
+        task = self._in_flight.get(key)
+
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(function(*args, **kwargs))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # shield: si un llamador se cancela, los demás siguen esperando la misma descarga
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight)
+        }
+
+
+flights = SingleFlight()
+
+
+def single_flight(key):
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            return await flights.do((function.__qualname__,) + key(*args, **kwargs), function, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,91 +1,155 @@
-import requests
 import pandas as pd
-from datetime import datetime, timedelta
-from config import api_key
+import indicators
+import sma_state
+import config
+from market_calendar import last_final_session, sessions_back, count_sessions
+from memory_cache import cache
+from historical_prices import fetch_historical_prices, stream_from_polygon
+from bar_store import delete_series
+from runtime import run
+from single_flight import single_flight
 
 
-def calculate_sma(data, period):
-    if len(data) < period:
-        return None
-    
-    return data[-period:].mean()
+# Medias que se reportan además de la SMA 50 / SMA 200 de la tendencia
+SMA_WINDOWS = getattr(config, 'sma_windows', [20, 50, 100, 200])
+EMA_WINDOWS = getattr(config, 'ema_windows', [20, 50])
+BOLLINGER_WINDOW = getattr(config, 'bollinger_window', 20)
+BOLLINGER_WIDTH = getattr(config, 'bollinger_width', 2.0)
+
+# Sesiones que se descargan para armar el estado desde cero
+HISTORY_DAYS = 250
+STATE_WINDOWS = sorted(set(SMA_WINDOWS) | set(EMA_WINDOWS) | {50, 200, BOLLINGER_WINDOW})
 
+# Historia que se revisa en busca de cruces SMA 50 / SMA 200 y sesiones para la tendencia del spread
+CROSS_HISTORY_DAYS = getattr(config, 'sma_cross_history_days', 1260)
+CROSS_SPREAD_SESSIONS = getattr(config, 'sma_cross_spread_sessions', 10)
+CROSS_LIST_LIMIT = 10
 
-def fetch_daily_prices(ticker, days=250):
-    to_date = datetime.now() - timedelta(days=1)  # Datos de hace 3 días
-    from_date = to_date - timedelta(days=days + 150)  # Extra días para compensar fines de semana
+
+@single_flight(lambda ticker, days=250: (ticker.strip().upper(), days))
+async def fetch_daily_prices(ticker, days=250):
+    # Exactamente 'days' sesiones de mercado hasta la última sesión cerrada
+    to_date = last_final_session()
+    from_date = sessions_back(days, to_date)
     
     from_str = from_date.strftime('%Y-%m-%d')
     to_str = to_date.strftime('%Y-%m-%d')
     
-    url = f"https://api.polygon.io/v2/aggs/ticker/{ticker}/range/1/day/{from_str}/{to_str}"
+    cache_key = ('daily', ticker, days, to_str)
+    df = cache.get(cache_key)
+    if df is not None:
+        print(f"⚡ Precios diarios de {ticker} encontrados en memoria")
+        return df
     
-    params = {
-        'adjusted': 'true',
-        'sort': 'asc',
-        'limit': 50000,  # Máximo permitido
-        'apiKey': api_key
-    }
+    # Mismo caché de barras diarias que los gráficos: con el rango ya guardado no se consulta a Polygon
+    daily = await fetch_historical_prices(ticker, 1, 'day', from_str, to_str)
+    if daily is None or daily.empty:
+        print(f"⚠️ No se encontraron precios diarios de {ticker} ({from_str} a {to_str})")
+        return None
     
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        print(f"📡 API Response status: {data.get('status')}")
-        print(f"📊 Results count: {len(data.get('results', []))}")
-        
-        if data.get('status') == 'OK' and 'results' in data and len(data['results']) > 0:
-            df = pd.DataFrame(data['results'])
-            df['date'] = pd.to_datetime(df['t'], unit='ms')
-            df = df.rename(columns={
-                'c': 'close',
-                'o': 'open',
-                'h': 'high',
-                'l': 'low',
-                'v': 'volume'
-            })
-            df = df[['date', 'close', 'open', 'high', 'low', 'volume']]
-            df.set_index('date', inplace=True)
-            df = df.sort_index()
-            
-            return df
-        else:
-            print(f"⚠️ No se encontraron datos: {data.get('status')}")
-            print(f"⚠️ Message: {data.get('message', 'No message')}")
-            print(f"⚠️ Full response: {data}")
+    df = daily_frame(daily)
+    cache.set(cache_key, df)
+    return df
+
+
+def daily_frame(daily):
+    # El caché guarda la hora de Nueva York; aquí se usa UTC sin zona (la barra diaria cae el mismo día)
+    df = daily[['close', 'open', 'high', 'low', 'volume']].copy()
+    df.index = daily.index.tz_convert('UTC').tz_localize(None).rename('date')
+    return df
+
+
+async def fetch_recent_prices(ticker, from_str, to_str):
+    # Directo a Polygon, sin el caché de barras: las barras guardadas no reflejan un split posterior
+    pages = []
+    async for page in stream_from_polygon(ticker, 1, 'day', from_str, to_str):
+        if page is None:
             return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error en la solicitud: {e}")
+        pages.append(page)
+    
+    if not pages:
         return None
+    return daily_frame(pd.concat(pages))
 
 
-def analyze_sma(ticker):
-    print(f"📊 Analizando SMA para {ticker}...")
+async def invalidate_prices(ticker):
+    # Precios reajustados: se descartan las barras diarias guardadas, el estado SMA y lo que haya en memoria
+    await delete_series(ticker, 1, 'day')
+    await sma_state.clear(ticker)
+    cache.invalidate_ticker(ticker)
+
+
+# Varios usuarios consultando el mismo ticker comparten una sola actualización (y una sola consulta a Polygon)
+@single_flight(lambda ticker: (ticker.strip().upper(),))
+async def update_sma_state(ticker):
+    # Estado móvil por ventana: con el estado al día no se consulta nada; si faltan sesiones
+    # solo se piden esas barras, y se reconstruye desde cero si Polygon reajustó los precios
+    to_date = last_final_session()
+    states = await sma_state.load(ticker, STATE_WINDOWS)
     
-    df = fetch_daily_prices(ticker, days=250)
-    #print(df)  # Mostrar el DataFrame obtenido
+    if states is not None:
+        last_date = next(iter(states.values())).last_date
+        if all(state.last_date == to_date.isoformat() for state in states.values()):
+            print(f"⚡ Estado SMA de {ticker} al día ({last_date})")
+            return states
+        
+        sessions = count_sessions(last_date, to_date)
+        if sessions <= HISTORY_DAYS:
+            # La barra de last_date se pide a Polygon para compararla con la guardada en el estado
+            df = await fetch_recent_prices(ticker, last_date, to_date.isoformat())
+            if df is not None and not df.empty:
+                updated, reason = sma_state.advance(states, df)
+                if updated is not None:
+                    print(f"➕ Estado SMA de {ticker} actualizado con {sessions - 1} sesiones nuevas")
+                    await sma_state.save(ticker, updated)
+                    return updated
+                if reason == sma_state.RESTATED:
+                    # Solo un cierre distinto indica un split: ahí las barras guardadas tampoco sirven
+                    print(f"🔁 Precios de {ticker} reajustados (split): se reconstruye el estado SMA")
+                    await invalidate_prices(ticker)
+                else:
+                    print(f"⚠️ Estado SMA de {ticker} inconsistente ({reason}): se reconstruye desde el caché")
     
+    df = await fetch_daily_prices(ticker, days=HISTORY_DAYS)
     if df is None or df.empty:
         return None
     
-    if len(df) < 200:
+    states = sma_state.build(df, STATE_WINDOWS)
+    await sma_state.save(ticker, states)
+    return states
+
+
+async def analyze_sma(ticker):
+    print(f"📊 Analizando SMA para {ticker}...")
+    
+    states = await update_sma_state(ticker)
+    
+    if states is None:
+        return None
+    
+    longest = states[200]
+    if not longest.full():
         return {
-            'error': f'No hay suficientes datos para calcular SMA 200 (solo {len(df)} días disponibles)'
+            'error': f'No hay suficientes datos para calcular SMA 200 (solo {len(longest.closes)} días disponibles)'
         }
     
-    close_prices = df['close']
-
-    sma_200 = calculate_sma(close_prices, 200)
-    sma_50 = calculate_sma(close_prices, 50) if len(df) >= 50 else None
+    # Cada media sale del estado guardado en O(1)
+    smas = {window: states[window].sma() for window in sorted(set(SMA_WINDOWS) | {50, 200}) if states[window].full()}
+    emas = {window: states[window].ema for window in EMA_WINDOWS if states[window].ema is not None}
+    
+    sma_200 = smas.get(200)
+    sma_50 = smas.get(50)
     
     print(sma_200, sma_50)  # Mostrar los valores calculados
+    
+    bollinger = None
+    if BOLLINGER_WINDOW in smas:
+        deviation = BOLLINGER_WIDTH * states[BOLLINGER_WINDOW].std()
+        bollinger = (smas[BOLLINGER_WINDOW] - deviation, smas[BOLLINGER_WINDOW] + deviation)
 
-    current_price = close_prices.iloc[-1]
-    last_date = df.index[-1]
-    first_date = df.index[0]
+    current_price = longest.closes[-1]
+    last_date = longest.last_date
+    first_date = sessions_back(len(longest.closes), last_date).isoformat()
     
     if sma_50 is None:
         trend = "Insuficientes datos para SMA 50"
@@ -109,8 +173,8 @@ def analyze_sma(ticker):
     result = {
         'ticker': ticker,
         'current_price': current_price,
-        'first_date': first_date.strftime('%Y-%m-%d'),
-        'last_date': last_date.strftime('%Y-%m-%d'),
+        'first_date': first_date,
+        'last_date': last_date,
         'sma_200': sma_200,
         'sma_50': sma_50,
         'trend': trend,
@@ -118,12 +182,36 @@ def analyze_sma(ticker):
         'trend_description': trend_description if sma_50 else "",
         'price_vs_sma200': sma_200_pct,
         'price_vs_sma50': sma_50_pct,
-        'total_days': len(df)
+        'smas': smas,
+        'emas': emas,
+        'bollinger': bollinger,
+        'total_days': len(longest.closes)
     }
     
     return result
 
 
+def format_other_averages(result):
+    current_price = result['current_price']
+    lines = []
+    
+    for window, value in sorted(result['smas'].items()):
+        if window not in (50, 200):
+            lines.append(f"📏 SMA {window} días: ${value:.2f} ({(current_price - value) / value * 100:+.2f}%)")
+    
+    for window, value in sorted(result['emas'].items()):
+        lines.append(f"〰️ EMA {window} días: ${value:.2f} ({(current_price - value) / value * 100:+.2f}%)")
+    
+    if result['bollinger']:
+        lower, upper = result['bollinger']
+        lines.append(f"🎯 Bollinger ({BOLLINGER_WINDOW}, {BOLLINGER_WIDTH:g}σ): ${lower:.2f} - ${upper:.2f}")
+    
+    if not lines:
+        return ""
+    
+    return "**Otras Medias:**\n" + "\n".join(lines) + "\n"
+
+
 def format_sma_result(result):
     if result is None:
         return "❌ No se pudieron obtener datos para el análisis."
@@ -146,6 +234,7 @@ def format_sma_result(result):
 📊 SMA 50 días: ${result['sma_50']:.2f}
    → Precio vs SMA50: {result['price_vs_sma50']:+.2f}%
 
+{format_other_averages(result)}
 **Análisis de Tendencia:**
 {result['signal']} **{result['trend']}**
 
@@ -162,11 +251,114 @@ def format_sma_result(result):
     return message
 
 
-def get_sma_analysis(ticker):
-    result = analyze_sma(ticker)
+async def analyze_crossovers(ticker):
+    print(f"🔀 Buscando cruces SMA para {ticker}...")
+    
+    # Pone al día el estado SMA; si detecta un split borra las barras guardadas antes de leer la historia
+    await update_sma_state(ticker)
+    df = await fetch_daily_prices(ticker, days=CROSS_HISTORY_DAYS)
+    
+    if df is None or df.empty:
+        return None
+    
+    if len(df) < 200:
+        return {
+            'error': f'No hay suficientes datos para calcular SMA 200 (solo {len(df)} días disponibles)'
+        }
+    
+    close_prices = df['close'].to_numpy(dtype='float64')
+    series = indicators.compute(close_prices, sma_windows=[50, 200])
+    sma_50, sma_200 = series['sma'][50], series['sma'][200]
+    
+    # Todos los cruces de la serie de una vez, sin recorrer día por día
+    indexes, directions = indicators.crossovers(sma_50, sma_200)
+    dates = df.index.strftime('%Y-%m-%d')
+    crosses = [
+        {'date': dates[index], 'type': 'golden' if direction > 0 else 'death', 'price': float(close_prices[index])}
+        for index, direction in zip(indexes, directions)
+    ]
+    
+    # Spread en % de la SMA 200 y su variación en las últimas sesiones
+    spread = (sma_50 - sma_200) / sma_200 * 100
+    spread_now = float(spread[-1])
+    spread_before = float(spread[max(len(spread) - 1 - CROSS_SPREAD_SESSIONS, 199)])
+    if abs(spread_now) > abs(spread_before):
+        spread_trend = "ampliándose"
+    elif abs(spread_now) < abs(spread_before):
+        spread_trend = "estrechándose"
+    else:
+        spread_trend = "estable"
+    
+    return {
+        'ticker': ticker,
+        'first_date': dates[199],
+        'last_date': dates[-1],
+        'total_days': len(df) - 199,
+        'crosses': crosses,
+        'golden_count': int((directions > 0).sum()),
+        'death_count': int((directions < 0).sum()),
+        'days_since_last': len(df) - 1 - int(indexes[-1]) if len(indexes) else None,
+        'spread': spread_now,
+        'spread_change': spread_now - spread_before,
+        'spread_trend': spread_trend
+    }
+
+
+def format_crossover_result(result):
+    if result is None:
+        return "❌ No se pudieron obtener datos para el análisis."
+    
+    if 'error' in result:
+        return f"❌ Error: {result['error']}"
+    
+    if result['crosses']:
+        lines = []
+        for cross in result['crosses'][-CROSS_LIST_LIMIT:]:
+            label = "🟢 Golden cross" if cross['type'] == 'golden' else "🔴 Death cross"
+            lines.append(f"{label} - {cross['date']} (${cross['price']:.2f})")
+        crosses = "\n".join(lines)
+        last = result['crosses'][-1]
+        last_cross = f"{'Golden' if last['type'] == 'golden' else 'Death'} cross hace {result['days_since_last']} sesiones ({last['date']})"
+    else:
+        crosses = "Sin cruces en el periodo analizado."
+        last_cross = "Sin cruces en el periodo analizado"
+    
+    position = "por encima" if result['spread'] > 0 else "por debajo"
+    
+    message = f"""
+🔀 **CRUCES SMA 50 / SMA 200 - {result['ticker']}**
+
+**Periodo analizado:**
+📅 {result['first_date']} - {result['last_date']} ({result['total_days']} sesiones con SMA 200)
+🟢 Golden crosses: {result['golden_count']}
+🔴 Death crosses: {result['death_count']}
+
+**Último cruce:**
+⏱️ {last_cross}
+
+**Últimos cruces:**
+{crosses}
+
+**Spread actual:**
+📏 La SMA 50 está {abs(result['spread']):.2f}% {position} de la SMA 200
+📈 Spread {result['spread_trend']} ({result['spread_change']:+.2f} pp en {CROSS_SPREAD_SESSIONS} sesiones)
+
+⚠️ **Nota:** Este análisis es solo informativo. No es asesoramiento financiero.
+"""
+    
+    return message
+
+
+async def get_sma_crossovers(ticker):
+    result = await analyze_crossovers(ticker)
+    return format_crossover_result(result)
+
+
+async def get_sma_analysis(ticker):
+    result = await analyze_sma(ticker)
     return format_sma_result(result)
 
 
 if __name__ == "__main__":
-    analysis = get_sma_analysis('AAPL')
+    analysis = run(get_sma_analysis('AAPL'))
     print(analysis)
@@ -0,0 +1,192 @@
+import copy
+import math
+from collections import deque
+import numpy as np
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from bar_store import engine
+from postgres_create_table import SmaState
+from memory_cache import cache
+import indicators
+
+
+# Diferencia relativa a partir de la cual un cierre guardado se considera reajustado (split, dividendo)
+RESTATEMENT_TOLERANCE = 1e-6
+
+
+class RollingWindow:
+    # Suma, suma de cuadrados y EMA de los últimos 'window' cierres, actualizadas en O(1) por barra
+
+    def __init__(self, window, closes=(), ema=None, last_date=None, running_sum=None, running_sum_sq=None, pushes=0):
+        self.window = window
+        self.closes = deque(closes, maxlen=window)
+        self.running_sum = math.fsum(self.closes) if running_sum is None else running_sum
+        self.running_sum_sq = math.fsum(c * c for c in self.closes) if running_sum_sq is None else running_sum_sq
+        self.ema = ema
+        self.last_date = last_date
+        self.pushes = pushes
+
+    def push(self, day, close):
+        if len(self.closes) == self.window:
+            oldest = self.closes[0]
+            self.running_sum -= oldest
+            self.running_sum_sq -= oldest * oldest
+
+        self.closes.append(close)
+        self.running_sum += close
+        self.running_sum_sq += close * close
+
+        if self.ema is not None:
+            self.ema += 2 / (self.window + 1) * (close - self.ema)
+        elif self.full():
+            self.ema = self.running_sum / self.window
+
+        self.last_date = day
+        self.pushes += 1
+        if self.pushes >= self.window:
+            # Cada 'window' barras se recalculan las sumas desde el buffer para no acumular error de redondeo
+            self.running_sum = math.fsum(self.closes)
+            self.running_sum_sq = math.fsum(c * c for c in self.closes)
+            self.pushes = 0
+
+    def full(self):
+        return len(self.closes) == self.window
+
+    def sma(self):
+        return self.running_sum / self.window if self.full() else None
+
+    def std(self):
+        if not self.full():
+            return None
+        mean = self.running_sum / self.window
+        return math.sqrt(max(self.running_sum_sq / self.window - mean * mean, 0.0))
+
+
+def build(df, windows):
+    # Estado inicial a partir de una serie diaria completa; la EMA sale del motor de indicadores
+    closes = df['close'].to_numpy(dtype='float64')
+    last_date = df.index[-1].strftime('%Y-%m-%d')
+    emas = indicators.ema(closes, windows)
+
+    states = {}
+    for window in windows:
+        ema = emas[window][-1] if len(closes) else np.nan
+        states[window] = RollingWindow(
+            window,
+            closes[-window:].tolist(),
+            ema=None if np.isnan(ema) else float(ema),
+            last_date=last_date
+        )
+    return states
+
+
+# Motivos por los que advance no puede usar el estado guardado
+MISMATCHED_DATES = 'mismatched_dates'
+MISSING_BAR = 'missing_bar'
+RESTATED = 'restated'
+
+
+def advance(states, df):
+    # Aplica las barras posteriores a last_date. Devuelve (estados, None) o (None, motivo) si el estado no sirve:
+    # fechas distintas entre ventanas, falta la barra de last_date o Polygon la reajustó (split)
+    last_dates = {state.last_date for state in states.values()}
+    if len(last_dates) != 1:
+        return None, MISMATCHED_DATES
+    last_date = last_dates.pop()
+
+    dates = df.index.strftime('%Y-%m-%d')
+    closes = df['close'].to_numpy(dtype='float64')
+
+    matches = np.flatnonzero(dates == last_date)
+    if len(matches) == 0:
+        return None, MISSING_BAR
+
+    stored = next(iter(states.values())).closes[-1]
+    fetched = closes[matches[0]]
+    if abs(fetched - stored) > RESTATEMENT_TOLERANCE * max(abs(stored), 1.0):
+        return None, RESTATED
+
+    states = {window: copy.deepcopy(state) for window, state in states.items()}
+    for day, close in zip(dates[matches[0] + 1:], closes[matches[0] + 1:]):
+        for state in states.values():
+            state.push(day, float(close))
+    return states, None
+
+
+async def load(ticker, windows):
+    # Primero memoria (microsegundos), después Postgres; None si falta alguna ventana
+    cache_key = ('sma_state', ticker)
+    states = cache.get(cache_key)
+    if states is not None and all(window in states for window in windows):
+        return states
+
+    try:
+        async with engine.connect() as connection:
+            rows = (await connection.execute(select(SmaState).where(
+                SmaState.ticker == ticker,
+                SmaState.window.in_(list(windows))
+            ))).all()
+    except Exception as e:
+        print(f"Error al leer el estado SMA: {e}")
+        return None
+
+    states = {
+        row.window: RollingWindow(
+            row.window, row.closes, ema=row.ema, last_date=row.last_date,
+            running_sum=row.running_sum, running_sum_sq=row.running_sum_sq, pushes=row.pushes
+        )
+        for row in rows
+    }
+    if not all(window in states for window in windows):
+        return None
+
+    cache.set(cache_key, states)
+    return states
+
+
+async def clear(ticker):
+    cache.invalidate(('sma_state', ticker))
+
+    try:
+        async with engine.begin() as connection:
+            await connection.execute(delete(SmaState).where(SmaState.ticker == ticker))
+    except Exception as e:
+        print(f"Error al borrar el estado SMA: {e}")
+
+
+async def save(ticker, states):
+    cache.set(('sma_state', ticker), states)
+
+    rows = [
+        {
+            'ticker': ticker,
+            'window': state.window,
+            'running_sum': state.running_sum,
+            'running_sum_sq': state.running_sum_sq,
+            'closes': list(state.closes),
+            'ema': state.ema,
+            'pushes': state.pushes,
+            'last_date': state.last_date
+        }
+        for state in states.values()
+    ]
+
+    try:
+        statement = insert(SmaState).values(rows)
+        statement = statement.on_conflict_do_update(
+            constraint='uq_sma_state_key',
+            set_={
+                'running_sum': statement.excluded.running_sum,
+                'running_sum_sq': statement.excluded.running_sum_sq,
+                'closes': statement.excluded.closes,
+                'ema': statement.excluded.ema,
+                'pushes': statement.excluded.pushes,
+                'last_date': statement.excluded.last_date,
+                'updated_at': func.now()
+            }
+        )
+        async with engine.begin() as connection:
+            await connection.execute(statement)
+
+    except Exception as e:
+        print(f"Error al guardar el estado SMA: {e}")
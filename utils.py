@@ -6,6 +6,8 @@ Puedo ayudarte con:
 
 📈 **Historical Prices** - Obtén precios históricos con gráficos personalizables
 📊 **SMA Analysis** - Calcula medias móviles y analiza tendencias
+🔀 **SMA Crosses** - Historial de golden y death crosses (SMA 50 / SMA 200)
+🧮 **Screener** - Ranking de tendencia SMA 50 / SMA 200 para una lista de acciones
 📋 **Full Data** - Información completa de una acción
 
 Usa /Guide para ver instrucciones detalladas.
@@ -20,7 +22,7 @@ GUIDE_MESSAGE = """
 3. Ingresa fecha inicial (formato: YYYY-MM-DD)
 4. Ingresa fecha final (formato: YYYY-MM-DD)
 5. Ingresa multiplicador de tiempo (número)
-6. Selecciona el periodo (day, week, month, etc.) - SOLO MINÚSCULAS
+6. Selecciona el periodo (minute, hour, day, week, month, etc.) - SOLO MINÚSCULAS
 7. Selecciona tipo de gráfico (candle o line) - SOLO MINÚSCULAS
 
 **📊 SMA ANALYSIS**
@@ -36,6 +38,23 @@ GUIDE_MESSAGE = """
 🔴 SMA200 > SMA50 → Tendencia BAJISTA
 🟡 SMA200 = SMA50 → CRUCE (Crossover)
 
+**🔀 SMA CROSSES**
+1. Selecciona "🔀 SMA Crosses" (o usa /SMA\\_crosses)
+2. Ingresa el ticker de la acción
+3. El bot mostrará:
+   - Todos los golden crosses (SMA50 cruza por encima de SMA200) y death crosses (por debajo)
+   - Sesiones desde el último cruce
+   - Si la distancia entre SMA50 y SMA200 se amplía o se estrecha
+
+**🧮 SCREENER**
+1. Selecciona "🧮 Screener" (o usa /Screener seguido de la lista)
+2. Ingresa el nombre de una watchlist (ej: mag7) o los tickers separados por espacios o comas
+3. El bot mostrará:
+   - Cantidad de acciones alcistas y bajistas
+   - Las de tendencia más fuerte y más débil según la distancia entre SMA50 y SMA200
+   - Sesiones desde el último cruce de cada una
+   - La tabla completa en un archivo CSV si la lista es larga
+
 **📋 FULL DATA**
 Obtiene información completa de precios de una acción.
 
@@ -49,15 +68,20 @@ Obtiene información completa de precios de una acción.
 ERROR_INVALID_TICKER = "❌ **Error:** Ticker inválido. Debe estar en MAYÚSCULAS (ej: AAPL, TSLA)"
 ERROR_INVALID_DATE = "❌ **Error:** Fecha inválida. Formato correcto: YYYY-MM-DD (ej: 2024-01-01)"
 ERROR_INVALID_MULTIPLIER = "❌ **Error:** El multiplicador debe ser un número entero positivo"
-ERROR_INVALID_PERIOD = "❌ **Error:** Periodo inválido. Usa: day, week, month, quarter, year (en minúsculas)"
+ERROR_INVALID_PERIOD = "❌ **Error:** Periodo inválido. Usa: minute, hour, day, week, month, quarter, year (en minúsculas)"
 ERROR_INVALID_CHART_TYPE = "❌ **Error:** Tipo de gráfico inválido. Usa: candle o line (en minúsculas)"
 ERROR_API_LIMIT = "❌ **Error:** Límite de API alcanzado. Intenta más tarde."
+ERROR_RANGE_TOO_LARGE = "❌ **Error:** El rango pedido supera las {max_bars:,} barras. Usa un rango más corto o un multiplicador mayor."
 ERROR_NO_DATA = "❌ **Error:** No se encontraron datos para los parámetros especificados."
 ERROR_MARKET_CLOSED = "⚠️ **Aviso:** El mercado está cerrado o es día festivo."
 ERROR_DATABASE = "❌ **Error:** Error al conectar con la base de datos."
+ERROR_INVALID_WATCHLIST = "❌ **Error:** Lista inválida. Usa el nombre de una watchlist o tickers en MAYÚSCULAS separados por espacios (ej: AAPL MSFT NVDA)"
+ERROR_BUSY = "⏳ Ya tienes una consulta en curso o el bot está muy ocupado. Intenta de nuevo en unos segundos."
 
 SUCCESS_GENERATING_CHART = "⏳ Generando gráfico... Por favor espera."
 SUCCESS_CALCULATING_SMA = "⏳ Calculando medias móviles... Por favor espera."
+SUCCESS_SCANNING_CROSSES = "⏳ Buscando cruces de medias móviles... Por favor espera."
+SUCCESS_SCREENING = "⏳ Analizando {count} acciones... Por favor espera."
 SUCCESS_CHART_GENERATED = "✅ Gráfico generado exitosamente!"
 SUCCESS_SMA_CALCULATED = "✅ Análisis SMA completado!"
 
@@ -67,6 +91,10 @@ PROMPT_END_DATE = "Ingresa la fecha final (formato: YYYY-MM-DD):"
 PROMPT_MULTIPLIER = "Ingresa el multiplicador de tiempo (número):"
 PROMPT_PERIOD = "Selecciona el periodo:"
 PROMPT_CHART_TYPE = "Selecciona el tipo de gráfico:"
+PROMPT_WATCHLIST = "Ingresa una watchlist (ej: mag7) o los tickers separados por espacios (ej: AAPL MSFT NVDA):"
+
+NOTE_DOWNSAMPLED_CANDLES = "ℹ️ {bars:,} barras agrupadas en {plotted:,} velas para el gráfico"
+NOTE_DOWNSAMPLED_LINE = "ℹ️ Línea simplificada a {plotted:,} de {bars:,} puntos (LTTB)"
 
 STATUS_FETCHING_DATA = "📡 Obteniendo datos de Polygon.io..."
 STATUS_CHECKING_CACHE = "🔍 Verificando caché en base de datos..."
@@ -96,7 +124,7 @@ def validate_multiplier(multiplier_str: str) -> bool:
 
 
 def validate_period(period: str) -> bool:
-    valid_periods = ['day', 'week', 'month', 'quarter', 'year']
+    valid_periods = ['minute', 'hour', 'day', 'week', 'month', 'quarter', 'year']
     return period in valid_periods
 
 
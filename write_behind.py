@@ -0,0 +1,154 @@
+import asyncio
+import time
+import pandas as pd
+import bar_store
+import config
+
+
+# Barras pendientes como máximo: con la cola llena las páginas nuevas se descartan en vez de esperar
+MAX_ROWS = getattr(config, 'write_behind_max_rows', 500000)
+BATCH_ITEMS = getattr(config, 'write_behind_batch_items', 64)
+FLUSH_INTERVAL_SECONDS = getattr(config, 'write_behind_flush_interval_seconds', 0.5)
+MAX_ATTEMPTS = getattr(config, 'write_behind_max_attempts', 5)
+RETRY_DELAY_SECONDS = getattr(config, 'write_behind_retry_delay_seconds', 1)
+
+
+class WriteBehind:
+    # Cola de escrituras al caché de Postgres fuera del camino de la respuesta al usuario.
+    # Un solo consumidor vacía la cola en lotes (una transacción por lote) y respeta el orden:
+    # la cobertura de un rango se escribe después de sus barras. Encolar nunca espera a Postgres
+
+    def __init__(self):
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.retries = 0
+        self.dropped = 0
+        self.rows = 0
+        self.last_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._failed = set()
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    async def enqueue_bars(self, ticker, multiplier, timespan, df):
+        if df.empty:
+            return
+        key = (ticker, multiplier, timespan)
+        self._start()
+        if self.rows + len(df) > MAX_ROWS:
+            # Sin estas barras la cobertura del rango tampoco se guarda y se vuelve a pedir más adelante
+            self.dropped += 1
+            self._failed.add(key)
+            print(f"⚠️ Cola de caché llena ({self.rows:,} barras): se descartan {len(df)} barras de {key}")
+            return
+        self.rows += len(df)
+        self._put(('bars', key, df))
+
+    async def enqueue_coverage(self, ticker, multiplier, timespan, from_date, to_date):
+        self._start()
+        self._put(('coverage', (ticker, multiplier, timespan), (from_date, to_date)))
+
+    async def close(self):
+        # Al apagar se escribe todo lo pendiente antes de cerrar las conexiones
+        if self._queue is None or self._loop is not asyncio.get_running_loop():
+            return
+        await self._queue.join()
+        if self._worker is not None:
+            self._worker.cancel()
+        self._loop = self._queue = self._worker = None
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'rows': self.rows,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'retries': self.retries,
+            'dropped': self.dropped,
+            'last_flush_ms': round(self.last_flush_ms, 1),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 1) if self.flushes else 0.0
+        }
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+            self.rows = 0
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    def _put(self, item):
+        # La cola no tiene tope de elementos: el límite de memoria lo pone MAX_ROWS en enqueue_bars
+        self._queue.put_nowait(item)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + FLUSH_INTERVAL_SECONDS
+            while len(batch) < BATCH_ITEMS:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+            finally:
+                self.rows -= sum(len(value) for kind, _, value in batch if kind == 'bars')
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        frames = {}
+        coverage = []
+        for kind, key, value in batch:
+            if kind == 'bars':
+                frames.setdefault(key, []).append(value)
+            elif key in self._failed:
+                # Sus barras no se pudieron guardar: sin cobertura el rango se vuelve a pedir
+                self._failed.discard(key)
+                print(f"⚠️ Cobertura descartada para {key} ({value[0]} a {value[1]})")
+            else:
+                coverage.append(key + value)
+
+        bars = []
+        for key, pages in frames.items():
+            df = pd.concat(pages) if len(pages) > 1 else pages[0]
+            bars.append(key + (df[~df.index.duplicated(keep='last')],))
+        rows = sum(len(df) for *_, df in bars)
+        if not bars and not coverage:
+            return
+
+        for attempt in range(MAX_ATTEMPTS):
+            started = time.perf_counter()
+            try:
+                await bar_store.write_batch(bars, coverage)
+            except Exception as e:
+                self.retries += 1
+                print(f"⚠️ Error al escribir en caché (intento {attempt + 1}/{MAX_ATTEMPTS}): {e}")
+                await asyncio.sleep(RETRY_DELAY_SECONDS * 2 ** attempt)
+                continue
+
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            self.total_flush_ms += self.last_flush_ms
+            self.flushes += 1
+            self.flushed_rows += rows
+            print(f"💾 {rows} barras y {len(coverage)} rangos guardados en {self.last_flush_ms:.0f} ms (cola: {self.depth()})")
+            return
+
+        self.dropped += len(batch)
+        covered = {tuple(item[:3]) for item in coverage}
+        self._failed.update(key for key in frames if key not in covered)
+        print(f"❌ Lote de caché descartado tras {MAX_ATTEMPTS} intentos ({rows} barras)")
+
+
+writer = WriteBehind()